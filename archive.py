@@ -1,15 +1,41 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from functools import cached_property
 from pathlib import Path
 from tempfile import NamedTemporaryFile
-from typing import List
+from typing import IO, Any, Dict, List, NamedTuple, Tuple
 from zipfile import ZipFile
 
 from natsort import natsorted
 
+from utils.configs import BUFFER_SIZE
+from utils.general import copy_stream
 
-class MoshZip(ZipFile):
+
+class ArchiveEntry(NamedTuple):
+    """A member of an archive along with the details needed to process it."""
+
+    name: str
+    kind: str
+    size: int
+    crc: int | None
+    compress_type: int
+
+
+class ArchiveView(ABC):
     """
-    A class that extends ZipFile to provide additional functionality for handling
-    specific file types and extracting subtitles.
+    Read-only interface shared by zip archives and merged views over several sources.
+
+    Subclasses provide the entries and a way to open them; everything else is
+    built on top of those. The manifest is built lazily on first access.
+
+    Attributes
+    ----------
+    entries : List[ArchiveEntry]
+        Every member of the archive, sorted in natural order.
+
+    manifest : Dict[str, List[ArchiveEntry]]
+        The entries grouped by kind ("video", "subtitle", "attachment" or "other").
 
     Methods
     -------
@@ -18,8 +44,65 @@ class MoshZip(ZipFile):
 
     extract_subtitles(video_path: str) -> Path:
         Extracts the subtitle file corresponding to the given video file path from the archive.
+
+    copy_member(member: str, target: Path, buffer_size: int) -> Path:
+        Streams a member of the archive into the given file.
+
+    content_key(entry: ArchiveEntry) -> str:
+        Returns a string that changes whenever the content of the entry changes.
     """
 
+    kinds = {
+        ".mp4": "video",
+        ".mkv": "video",
+        ".srt": "subtitle",
+        ".vtt": "subtitle",
+        ".ass": "subtitle",
+        ".zip": "attachment",
+        ".pdf": "attachment",
+    }
+
+    @property
+    @abstractmethod
+    def entries(self) -> List[ArchiveEntry]:
+        pass
+
+    @abstractmethod
+    def open(self, name: str) -> IO[bytes]:  # type: ignore
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> Any:
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
+
+    @cached_property
+    def manifest(self) -> Dict[str, List[ArchiveEntry]]:
+        manifest: Dict[str, List[ArchiveEntry]] = {
+            kind: [] for kind in ("video", "subtitle", "attachment", "other")
+        }
+        for entry in self.entries:
+            manifest[entry.kind].append(entry)
+        return manifest
+
+    @classmethod
+    def kind_of(cls, name: str) -> str:
+        """
+        Returns the kind of a member ("video", "subtitle", "attachment" or "other") from its name.
+        """
+        return cls.kinds.get(Path(name).suffix, "other")
+
+    def content_key(self, entry: ArchiveEntry) -> str:
+        """
+        Returns a string identifying the content of an entry, e.g. for cache keys.
+        """
+        return f"{entry.name}:{entry.crc:08x}:{entry.size}"
+
     def namelist_from_ext(self, *extensions: str) -> List[str]:
         """
         Generate a list of file names from the archive that match the given extensions.
@@ -31,19 +114,38 @@ class MoshZip(ZipFile):
             List[str]: A list of file names sorted in natural order that have the specified extensions.
         """
         return [
-            file
-            for file in natsorted(self.namelist())
-            if Path(file).suffix in extensions
+            entry.name
+            for entry in self.entries
+            if Path(entry.name).suffix in extensions
         ]
 
+    @cached_property
+    def _subtitle_index(self) -> Tuple[Dict[str, str], List[Tuple[str, int, str]]]:
+        """
+        Maps the stem of every subtitle member to the first such member in natural
+        order, and keeps all the (stem, order, name) triples sorted by stem, so that
+        both exact and prefix lookups don't have to scan the archive.
+        """
+        exact: Dict[str, str] = {}
+        stems: List[Tuple[str, int, str]] = []
+        for order, entry in enumerate(self.manifest["subtitle"]):
+            stem = str(Path(entry.name).with_suffix(""))
+            exact.setdefault(stem, entry.name)
+            stems.append((stem, order, entry.name))
+        stems.sort()
+        return exact, stems
+
     def extract_subtitles(self, video_path: str) -> Path | None:
         """
         Extracts subtitles from an archive that match the given video path.
 
-        This method searches for subtitle files within the archive that have the same
-        base name as the provided video path and one of the specified subtitle file
-        extensions (".srt", ".vtt", ".ass"). If a matching subtitle file is found,
-        it is extracted to a temporary file and returned.
+        This method looks up subtitle files within the archive whose base name is, or
+        starts with, the base name of the provided video path, and that have one of
+        the specified subtitle file extensions (".srt", ".vtt", ".ass"). Exact matches
+        are preferred over ones with extra text such as ".en.srt" or " - English.srt";
+        that extra text must not start with a letter or digit, so "Lesson 10.srt"
+        doesn't match "Lesson 1.mp4". If a matching subtitle file is found, it is
+        extracted to a temporary file and returned.
 
         Args:
             video_path (str): The path to the video file for which to extract subtitles.
@@ -51,12 +153,171 @@ class MoshZip(ZipFile):
         Returns:
             Path | None: The path to the extracted subtitle file if found, otherwise None.
         """
-        archived_subs = self.namelist_from_ext(".srt", ".vtt", ".ass")
+        exact, stems = self._subtitle_index
         prefix = str(Path(video_path).with_suffix(""))
-        for archived_sub in archived_subs:
-            if archived_sub.startswith(prefix):
-                subtitle = Path(
-                    NamedTemporaryFile(suffix=Path(archived_sub).suffix).name
-                )
-                subtitle.write_bytes(self.read(archived_sub))
-                return subtitle
+        archived_sub = exact.get(prefix)
+        if archived_sub is None:
+            matches = []
+            for index in range(bisect_left(stems, (prefix,)), len(stems)):
+                stem, order, name = stems[index]
+                if not stem.startswith(prefix):
+                    break
+                if not stem[len(prefix)].isalnum():
+                    matches.append((order, name))
+            archived_sub = min(matches)[1] if matches else None
+        if archived_sub is None:
+            return None
+        subtitle = Path(NamedTemporaryFile(suffix=Path(archived_sub).suffix).name)
+        return self.copy_member(archived_sub, subtitle)
+
+    def copy_member(
+        self,
+        member: str,
+        target: Path,
+        buffer_size: int = BUFFER_SIZE,
+        hasher: Any = None,
+    ) -> Path:
+        """
+        Streams a member of the archive into a file without loading it into memory.
+
+        Args:
+            member (str): The name of the member in the archive.
+            target (Path): The file to write the member to.
+            buffer_size (int, optional): The size of each chunk in bytes. Defaults to BUFFER_SIZE.
+            hasher (hashlib hash object, optional): Updated with the copied bytes. Defaults to None.
+
+        Returns:
+            Path: The path to the written file.
+        """
+        with self.open(member) as source, target.open("wb") as output:
+            copy_stream(source, output, buffer_size, hasher)
+        return target
+
+
+class MoshZip(ZipFile, ArchiveView):
+    """
+    A class that extends ZipFile to provide additional functionality for handling
+    specific file types and extracting subtitles (see ArchiveView).
+    """
+
+    @cached_property
+    def entries(self) -> List[ArchiveEntry]:
+        infos = natsorted(self.infolist(), key=lambda info: info.filename)
+        return [
+            ArchiveEntry(
+                info.filename,
+                "other" if info.is_dir() else self.kind_of(info.filename),
+                info.file_size,
+                info.CRC,
+                info.compress_type,
+            )
+            for info in infos
+        ]
+
+
+class MergedZip(ArchiveView):
+    """
+    A read-only view that merges several zip archives and directories without
+    unpacking them.
+
+    The members of each source are namespaced by the index of the source, just
+    like the contents of an archive built by unpacking every source into its own
+    numbered directory. Members are read directly from the original sources.
+
+    Args:
+        *archives (Path): The zip archives or directories to merge.
+        start (int, optional): The index of the first source. Defaults to 0.
+
+    Methods
+    -------
+    add_file(file: Path, arcname: str) -> None:
+        Adds a file from disk to the view under the given name.
+
+    locate(name: str) -> Tuple[MoshZip | Path, str]:
+        Returns the source archive and member name, or the file on disk, behind a member.
+    """
+
+    def __init__(self, *archives: Path, start: int = 0) -> None:
+        self.archives = archives
+        self.__zips: List[MoshZip] = []
+        self.__members: Dict[str, Tuple[MoshZip | Path, str]] = {}
+        for index, archive in enumerate(archives, start):
+            if archive.is_dir():
+                for file in archive.rglob("*"):
+                    if file.is_file():
+                        name = f"{index}/{file.relative_to(archive).as_posix()}"
+                        self.__members[name] = (file, "")
+                continue
+            zip_ref = MoshZip(archive)
+            self.__zips.append(zip_ref)
+            for info in zip_ref.infolist():
+                self.__members[f"{index}/{info.filename}"] = (zip_ref, info.filename)
+
+    @cached_property
+    def entries(self) -> List[ArchiveEntry]:
+        entries: List[ArchiveEntry] = []
+        for name, (source, member) in self.__members.items():
+            if isinstance(source, Path):
+                size = source.stat().st_size
+                entries.append(ArchiveEntry(name, self.kind_of(name), size, None, 0))
+                continue
+            info = source.getinfo(member)
+            kind = "other" if info.is_dir() else self.kind_of(name)
+            entries.append(
+                ArchiveEntry(name, kind, info.file_size, info.CRC, info.compress_type)
+            )
+        return natsorted(entries, key=lambda entry: entry.name)
+
+    def content_key(self, entry: ArchiveEntry) -> str:
+        source, _ = self.__members[entry.name]
+        if isinstance(source, Path):
+            return f"{source.resolve()}:{entry.size}:{source.stat().st_mtime_ns}"
+        return super().content_key(entry)
+
+    def locate(self, name: str) -> Tuple[MoshZip | Path, str]:
+        """
+        Returns where a member of the view is stored.
+
+        Args:
+            name (str): The name of the member in the view.
+
+        Returns:
+            Tuple[MoshZip | Path, str]: The source archive and the name of the member in it,
+                                        or the file on disk and an empty string.
+        """
+        return self.__members[name]
+
+    def open(self, name: str) -> IO[bytes]:  # type: ignore
+        source, member = self.__members[name]
+        if isinstance(source, Path):
+            return source.open("rb")
+        return source.open(member)
+
+    def add_file(self, file: Path, arcname: str) -> None:
+        """
+        Adds a file from disk to the view under the given name.
+
+        Args:
+            file (Path): The file to add.
+            arcname (str): The name of the file in the view.
+        """
+        self.__members[arcname] = (file, "")
+        for cached in ("entries", "manifest", "_subtitle_index"):
+            self.__dict__.pop(cached, None)
+
+    def close(self) -> None:
+        for zip_ref in self.__zips:
+            zip_ref.close()
+
+
+def open_archive(source: "Path | ArchiveView") -> ArchiveView:
+    """
+    Opens a zip archive as a MoshZip, passing already opened archive views through.
+
+    Args:
+        source (Path | ArchiveView): The path to a zip archive or an archive view.
+
+    Returns:
+        ArchiveView: The opened archive.
+    """
+    return source if isinstance(source, ArchiveView) else MoshZip(source)
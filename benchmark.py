@@ -0,0 +1,430 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from typing import Callable, Dict, Iterator, List, NamedTuple, Tuple
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import ffmpeg
+from archive import open_archive
+from utils.archive import extract_non_videos, extract_videos, merge_zips
+from utils.configs import TEMP
+
+# Size of a memory page, in which /proc reports the resident memory.
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+SUBTITLES = "1\n00:00:00,000 --> 00:00:02,000\nSynthetic subtitle\n"
+# Dependencies that the lightweight commands of main.py must not import.
+HEAVY_MODULES = ["requests", "bs4", "yt_dlp", "seedrcc", "pyperclip", "tqdm", "natsort"]
+# Runs main.py with the given arguments, then reports on stderr which heavy
+# modules were imported and which lazy settings of utils.configs were resolved.
+STARTUP_SCRIPT = f"""
+import runpy, sys
+sys.argv = ["main.py", *sys.argv[1:]]
+try:
+    runpy.run_path("main.py", run_name="__main__")
+except SystemExit:
+    pass
+import utils.configs
+loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+loaded += [name for name in ("TEMP", "DOWNLOADS") if name in vars(utils.configs)]
+print("loaded:", *loaded, file=sys.stderr)
+"""
+
+
+class StageResult(NamedTuple):
+    """The measurements of a single benchmark stage."""
+
+    name: str
+    seconds: float
+    size: int
+    lessons: int
+    peak_rss: int
+    peak_disk: int
+
+    @property
+    def throughput(self) -> float:
+        return self.size / self.seconds / 1024**2 if self.seconds else 0.0
+
+    @property
+    def lesson_rate(self) -> float:
+        return self.lessons / self.seconds if self.seconds else 0.0
+
+
+class ResourceSampler:
+    """
+    Samples in the background the memory resident for this process and its
+    descendants, and the space used on the filesystems of the given directories.
+    It remembers the highest memory use, and how far the disk usage grew above
+    the starting point.
+
+    Short-lived child processes may finish between two samples and go unseen.
+
+    Args:
+        *directories (Path): Directories on the filesystems to watch.
+        interval (float, optional): Seconds between two samples. Defaults to 0.05.
+    """
+
+    def __init__(self, *directories: Path, interval: float = 0.05) -> None:
+        devices: Dict[int, Path] = {}
+        for directory in directories:
+            devices.setdefault(directory.stat().st_dev, directory)
+        self.directories = list(devices.values())
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self.__stop = Event()
+        self.__thread = Thread(target=self.__run, daemon=True)
+
+    def __enter__(self) -> "ResourceSampler":
+        self.__base = self.__used()
+        self.__sample()
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.__stop.set()
+        self.__thread.join()
+        self.__sample()
+
+    def __used(self) -> int:
+        return sum(shutil.disk_usage(directory).used for directory in self.directories)
+
+    def __sample(self) -> None:
+        self.peak_rss = max(self.peak_rss, resident_memory())
+        self.peak_disk = max(self.peak_disk, self.__used() - self.__base)
+
+    def __run(self) -> None:
+        while not self.__stop.wait(self.interval):
+            self.__sample()
+
+
+def resident_memory() -> int:
+    """
+    Returns the memory currently resident for this process and all of its
+    descendants (e.g. ffmpeg), in bytes, or 0 where /proc isn't available.
+    """
+    try:
+        pids = [int(name) for name in os.listdir("/proc") if name.isdigit()]
+    except FileNotFoundError:
+        return 0
+    children: Dict[int, List[int]] = {}
+    for pid in pids:
+        try:
+            stat = Path(f"/proc/{pid}/stat").read_text()
+        except OSError:
+            continue
+        # the fields after the parenthesized command are the state and the parent
+        parent = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(parent, []).append(pid)
+    total = 0
+    family = [os.getpid()]
+    while family:
+        pid = family.pop()
+        family.extend(children.get(pid, []))
+        try:
+            pages = int(Path(f"/proc/{pid}/statm").read_text().split()[1])
+        except OSError:
+            continue
+        total += pages * PAGE_SIZE
+    return total
+
+
+def make_video(target: Path, duration: int, resolution: str) -> Path:
+    """
+    Renders a test pattern video with a tone, like a lesson but entirely synthetic.
+    """
+    command = ffmpeg.ffmpeg + [
+        "-f",
+        "lavfi",
+        "-i",
+        f"testsrc2=s={resolution}:d={duration}:r=30",
+        "-f",
+        "lavfi",
+        "-i",
+        f"sine=f=440:d={duration}",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "ultrafast",
+        "-pix_fmt",
+        "yuv420p",
+        "-c:a",
+        "aac",
+        "-shortest",
+        str(target),
+    ]
+    subprocess.run(command, check=True, capture_output=True)
+    return target
+
+
+def make_course(directory: Path, args: argparse.Namespace) -> List[Path]:
+    """
+    Writes a synthetic course split into `args.parts` zip archives.
+
+    Every part holds its share of the lessons in numbered sections, a subtitle
+    file for every other lesson, and fake PDFs and nested source code zips.
+
+    Returns:
+        List[Path]: The parts, in order.
+    """
+    video = make_video(directory / "lesson.mp4", args.duration, args.resolution)
+    compression = ZIP_DEFLATED if args.compression == "deflated" else ZIP_STORED
+    attachment = os.urandom(args.attachment_size * 1024)
+    with ZipFile(directory / "source.zip", "w", ZIP_DEFLATED) as nested:
+        nested.writestr("src/main.py", attachment)
+    parts: List[Path] = []
+    per_part = -(-args.lessons // args.parts)
+    for index in range(args.parts):
+        part = directory / f"part{index + 1}.zip"
+        lessons = range(
+            index * per_part + 1, min((index + 1) * per_part, args.lessons) + 1
+        )
+        with ZipFile(part, "w", compression) as zip_ref:
+            for lesson in lessons:
+                section = f"Course/{(lesson - 1) // 10 + 1}- Section"
+                name = f"{section}/{lesson}- Lesson {lesson}"
+                zip_ref.write(video, f"{name}.mp4")
+                if lesson % 2:
+                    zip_ref.writestr(f"{name}.srt", SUBTITLES)
+                if lesson % 10 == 1:
+                    zip_ref.writestr(
+                        f"{section}/slides.pdf", b"%PDF-1.4\n" + attachment
+                    )
+                    zip_ref.write(directory / "source.zip", f"{section}/source.zip")
+        parts.append(part)
+    return parts
+
+
+def targets(directory: Path, count: int) -> Iterator[Path]:
+    return (
+        directory / "Course" / f"{i:02}- Lesson {i}.mkv" for i in range(1, count + 1)
+    )
+
+
+def measure(
+    name: str, size: int, lessons: int, stage: Callable[[], object]
+) -> StageResult:
+    """
+    Runs a stage and measures its duration, peak memory and temporary disk usage.
+    """
+    with ResourceSampler(TEMP, Path(tempfile.gettempdir())) as usage:
+        start = time.perf_counter()
+        stage()
+        seconds = time.perf_counter() - start
+    return StageResult(name, seconds, size, lessons, usage.peak_rss, usage.peak_disk)
+
+
+def run(args: argparse.Namespace) -> List[StageResult]:
+    """
+    Generates a synthetic course and times every stage of the extraction pipeline on it.
+    """
+    with TemporaryDirectory(dir=TEMP) as temp_dir:
+        directory = Path(temp_dir)
+        # start with an empty thumbnail cache so that every run does the same work
+        ffmpeg.CACHE = directory / "cache"
+        print("Generating course...")
+        parts = make_course(directory, args)
+        size = sum(part.stat().st_size for part in parts)
+        with open_archive(merge_zips(*parts)) as archive:
+            videos = archive.manifest["video"]
+            video_size = sum(entry.size for entry in videos)
+            attachment_size = sum(
+                entry.size for entry in archive.manifest["attachment"]
+            )
+
+        results: List[StageResult] = []
+        output = directory / "output"
+        results.append(
+            measure(
+                "merge_zips", size, 0, lambda: open_archive(merge_zips(*parts)).close()
+            )
+        )
+        results.append(
+            measure(
+                "merge_zips (repack)",
+                size,
+                0,
+                lambda: merge_zips(*parts, post_process=lambda path: path).unlink(),  # type: ignore
+            )
+        )
+        with open_archive(merge_zips(*parts)) as archive:
+            results.append(
+                measure(
+                    "extract_videos",
+                    video_size,
+                    len(videos),
+                    lambda: extract_videos(
+                        archive, targets(output / "copy", len(videos)), jobs=args.jobs
+                    ),
+                )
+            )
+            results.append(
+                measure(
+                    "extract_videos (ffmpeg)",
+                    video_size,
+                    len(videos),
+                    lambda: extract_videos(
+                        archive,
+                        targets(output / "ffmpeg", len(videos)),
+                        ffmpeg=True,
+                        jobs=args.jobs,
+                    ),
+                )
+            )
+            results.append(
+                measure(
+                    "extract_non_videos",
+                    attachment_size,
+                    0,
+                    lambda: extract_non_videos(archive, output / "files"),
+                )
+            )
+
+        copies = list(targets(output / "copy", len(videos)))
+        remuxed = list(targets(output / "ffprocess", len(videos)))
+        remuxed[0].parent.mkdir(parents=True, exist_ok=True)
+        results.append(
+            measure(
+                "ffprocess",
+                video_size,
+                len(videos),
+                lambda: [
+                    ffmpeg.ffprocess(video, target, args.timestamp)
+                    for video, target in zip(copies, remuxed)
+                ],
+            )
+        )
+        return results
+
+
+def check_startup(limit: float) -> List[str]:
+    """
+    Checks that `main.py --help` and `main.py --list-configs` start quickly.
+
+    Each command is run in a fresh interpreter and must neither import any of
+    HEAVY_MODULES nor resolve TEMP or DOWNLOADS, and must not take more than
+    `limit` milliseconds longer than starting a bare interpreter.
+
+    Args:
+        limit (float): The allowed overhead in milliseconds.
+
+    Returns:
+        List[str]: The problems found, if any.
+    """
+    root = Path(__file__).parent
+
+    def launch(*arguments: str) -> Tuple[float, str]:
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, *arguments], cwd=root, capture_output=True, text=True
+        )
+        milliseconds = (time.perf_counter() - start) * 1000
+        if result.returncode:
+            raise RuntimeError(result.stderr)
+        return milliseconds, result.stderr
+
+    baseline = min(launch("-c", "pass")[0] for _ in range(3))
+    problems: List[str] = []
+    for command in ("--help", "--list-configs"):
+        runs = [launch("-c", STARTUP_SCRIPT, command) for _ in range(3)]
+        overhead = min(milliseconds for milliseconds, _ in runs) - baseline
+        loaded = runs[-1][1].splitlines()[-1].split()[1:]
+        print(f"main.py {command}: {overhead:.0f} ms over a bare interpreter")
+        if loaded:
+            problems.append(f"main.py {command} loads {', '.join(loaded)}")
+        if overhead > limit:
+            problems.append(f"main.py {command} takes {overhead:.0f} ms (> {limit} ms)")
+    return problems
+
+
+def report(results: List[StageResult], args: argparse.Namespace) -> str:
+    lines = [
+        f"lessons={args.lessons} parts={args.parts} duration={args.duration}s "
+        f"resolution={args.resolution} compression={args.compression} jobs={args.jobs}",
+        f"{'stage':<26}{'seconds':>9}{'MB/s':>10}{'lessons/s':>11}"
+        f"{'peak RSS MB':>13}{'temp MB':>10}",
+    ]
+    for result in results:
+        lines.append(
+            f"{result.name:<26}{result.seconds:>9.2f}{result.throughput:>10.1f}"
+            f"{result.lesson_rate:>11.2f}{result.peak_rss / 1024**2:>13.1f}"
+            f"{result.peak_disk / 1024**2:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Times the extraction pipeline on a synthetic course"
+    )
+    parser.add_argument(
+        "-n", "--lessons", type=int, default=20, help="Number of lessons"
+    )
+    parser.add_argument("-p", "--parts", type=int, default=1, help="Number of archives")
+    parser.add_argument(
+        "-d", "--duration", type=int, default=10, help="Length of a lesson in seconds"
+    )
+    parser.add_argument(
+        "-r", "--resolution", default="1280x720", help="Resolution of the lessons"
+    )
+    parser.add_argument(
+        "-a",
+        "--attachment-size",
+        type=int,
+        default=512,
+        help="Size of every PDF and source archive in KiB",
+    )
+    parser.add_argument(
+        "-c",
+        "--compression",
+        choices=["stored", "deflated"],
+        default="stored",
+        help="How the members of the archives are compressed",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of lessons processed in parallel",
+    )
+    parser.add_argument(
+        "-t", "--timestamp", type=int, default=1, help="Timestamp of the thumbnails"
+    )
+    parser.add_argument(
+        "-o", "--output", type=Path, help="Append the report to this file as well"
+    )
+    parser.add_argument(
+        "-s",
+        "--startup",
+        type=float,
+        nargs="?",
+        const=100,
+        help="Only check the startup time of main.py, allowing this many ms (default: 100)",
+    )
+    args = parser.parse_args()
+    if args.startup is not None:
+        problems = check_startup(args.startup)
+        for problem in problems:
+            print(f"Error: {problem}")
+        parser.exit(1 if problems else 0)
+    if min(args.lessons, args.parts, args.jobs) < 1:
+        parser.error("The lessons, parts and jobs must be at least 1")
+    if args.parts > args.lessons:
+        parser.error("There can't be more parts than lessons")
+
+    text = report(run(args), args)
+    print(f"\n{text}")
+    if args.output:
+        with args.output.open("a") as file:
+            file.write(f"{text}\n\n")
+
+
+if __name__ == "__main__":
+    main()
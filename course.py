@@ -2,12 +2,18 @@ import json
 import os
 from abc import ABC, abstractmethod
 from pathlib import Path
+from threading import Lock
 from typing import Any, Dict, Iterator
 import string
 import requests
 from bs4 import BeautifulSoup
 
+from utils.cache import DiskCache
+from utils.configs import CACHE, MAX_CONNECTIONS
 from utils.general import clean_path
+from utils.network import get_session
+from utils.pool import imap_ordered
+from utils.profile import profiled
 
 
 class CourseSerializer(ABC):
@@ -27,12 +33,15 @@ class CourseSerializer(ABC):
         get_videos(root: Path, bundle: "CourseBundle | None" = None) -> Iterator[Path]:
             Abstract method to be implemented by subclasses to get video paths.
 
-        get_token() -> str:
+        get_token(outdated: str | None = None) -> str:
             Retrieves a token required for accessing course data.
 
         get_data() -> Dict[Any, Any]:
             Fetches course data from the Code with Mosh website.
 
+        get_page(path: str) -> Dict[Any, Any]:
+            Fetches the data of a page, going through the metadata cache.
+
         get_json(url: str) -> Dict[Any, Any]:
             Fetches and parses JSON data from the given URL.
 
@@ -55,6 +64,12 @@ class CourseSerializer(ABC):
         ".js",
     ]
 
+    cache = DiskCache(CACHE / "metadata")
+    token_ttl = 6 * 60 * 60
+    page_ttl = 7 * 24 * 60 * 60
+    __token: str | None = None
+    __token_lock = Lock()
+
     def __init__(self, slug: str) -> None:
         self.slug = slug
         self._data = self.get_data()
@@ -82,23 +97,44 @@ class CourseSerializer(ABC):
     ) -> Iterator[Path]:
         pass
 
-    @staticmethod
-    def get_token() -> str:
+    @classmethod
+    @profiled("get_token")
+    def get_token(cls, outdated: str | None = None) -> str:
         """
         Fetches a token from the specified URL.
 
+        The token is fetched at most once per process and is also kept in the
+        metadata cache for `token_ttl` seconds, so runs reusing the cache don't
+        need to fetch it at all.
+
         This function sends a GET request to the URL "https://codewithmosh.com/",
         parses the HTML content to find a specific tag with the id "__NEXT_DATA__",
         and extracts the "buildId" from the JSON content of that tag.
 
+        Args:
+            outdated (str | None, optional): A token the website rejected. If it is still the
+                                             current one, a new token is fetched. Defaults to None.
+
         Returns:
             str: The extracted token (buildId).
 
         Raises:
             ValueError: If the token cannot be found in the HTML content.
         """
+        with cls.__token_lock:
+            token = CourseSerializer.__token
+            if not token:
+                token = cls.cache.get("buildId", cls.token_ttl)
+            if not token or token == outdated:
+                token = cls.fetch_token()
+                cls.cache.set("buildId", token)
+            CourseSerializer.__token = token
+            return token
+
+    @staticmethod
+    def fetch_token() -> str:
         url = "https://codewithmosh.com/"
-        response = requests.get(url)
+        response = get_session().get(url)
         soup = BeautifulSoup(response.content, "html.parser")
         tag = soup.select_one("#__NEXT_DATA__")
         if tag and tag.string:
@@ -112,10 +148,38 @@ class CourseSerializer(ABC):
         Returns:
             Dict[Any, Any]: The JSON response from the constructed URL.
         """
-        url = (
-            f"https://codewithmosh.com/_next/data/{self.get_token()}/p/{self.slug}.json"
-        )
-        return self.get_json(url)
+        return self.get_page(f"p/{self.slug}")
+
+    @classmethod
+    def get_page(cls, path: str) -> Dict[Any, Any]:
+        """
+        Fetches the 'pageProps' of a page of the website, e.g. "p/<slug>" or "courses".
+
+        Pages are kept in the metadata cache for `page_ttl` seconds and are only
+        reused while the token they were fetched with is current. If the token
+        turns out to be outdated, a new one is fetched and the page is requested again.
+
+        Args:
+            path (str): The path of the page, without the ".json" extension.
+
+        Returns:
+            Dict[Any, Any]: The 'pageProps' content of the page.
+        """
+        token = cls.get_token()
+        cached = cls.cache.get(path, cls.page_ttl, tag=token)
+        if cached is not None:
+            return cached
+        url = f"https://codewithmosh.com/_next/data/{token}/{path}.json"
+        try:
+            data = cls.get_json(url)
+        except requests.HTTPError as error:
+            if error.response is None or error.response.status_code != 404:
+                raise
+            token = cls.get_token(outdated=token)
+            url = f"https://codewithmosh.com/_next/data/{token}/{path}.json"
+            data = cls.get_json(url)
+        cls.cache.set(path, data, tag=token)
+        return data
 
     @staticmethod
     def get_json(url: str) -> Dict[Any, Any]:
@@ -133,7 +197,8 @@ class CourseSerializer(ABC):
             json.JSONDecodeError: If the response content is not valid JSON.
             KeyError: If 'pageProps' is not found in the JSON response.
         """
-        response = requests.get(url)
+        response = get_session().get(url)
+        response.raise_for_status()
         return json.loads(response.content)["pageProps"]
 
     def __str__(self) -> str:
@@ -268,20 +333,21 @@ class CourseBundle(CourseSerializer):
         """
         Fetches and returns an iterator of Course objects.
 
-        This method constructs a URL using a token and retrieves a JSON response
-        containing course data. It then filters and returns an iterator of Course
-        objects for courses that are part of the bundle contents.
+        This method retrieves the course catalogue through the metadata cache.
+        It then filters and returns an iterator of Course objects for courses
+        that are part of the bundle contents. The courses are fetched concurrently
+        but yielded in catalogue order.
 
         Returns:
             Iterator[Course]: An iterator of Course objects.
         """
-        url = f"https://codewithmosh.com/_next/data/{self.get_token()}/courses.json"
-        courses = self.get_json(url)
-        return (
-            Course(course["slug"])
+        courses = self.get_page("courses")
+        slugs = [
+            course["slug"]
             for course in courses["courses"]
             if course["id"] in self._data["course"]["bundleContents"]
-        )
+        ]
+        return imap_ordered(Course, slugs, MAX_CONNECTIONS)
 
     def get_common_part(self) -> str:
         """
@@ -1,7 +1,16 @@
+import hashlib
+import json
+import os
 import re
 import subprocess
+from functools import lru_cache
 from pathlib import Path
 from tempfile import NamedTemporaryFile
+from typing import Any, Dict, List
+
+from utils.configs import CACHE
+from utils.pool import ffmpeg_budget
+from utils.profile import profiled, run
 
 ffmpeg = ["ffmpeg", "-y"]
 _metadata = [
@@ -18,31 +27,158 @@ _metadata = [
     "-map_chapters:g",
     "-1",
 ]
+# Encoder settings of blank videos, which show a single still frame.
+_blank_codecs = [
+    "-c:v",
+    "libx264",
+    "-preset",
+    "ultrafast",
+    "-tune",
+    "stillimage",
+    "-c:a",
+    "aac",
+]
+
+
+def _run_ffmpeg(command: List[str], **kwargs: Any) -> subprocess.CompletedProcess:
+    """
+    Runs an ffmpeg command once the process-wide ffmpeg budget allows it.
+    """
+    with ffmpeg_budget:
+        return run(command, **kwargs)
+
+
+class MediaInfo:
+    """
+    Structured result of a single ffprobe run on a media file.
+
+    Attributes:
+        streams (List[Dict[str, Any]]): The streams reported by ffprobe.
+        format (Dict[str, Any]): The container information reported by ffprobe.
+        duration (float | None): The duration of the media in seconds, if known.
+    """
+
+    def __init__(self, data: Dict[str, Any]) -> None:
+        self.streams: List[Dict[str, Any]] = data.get("streams", [])
+        self.format: Dict[str, Any] = data.get("format", {})
+        duration = self.format.get("duration")
+        self.duration = float(duration) if duration else None
+
+    def get_streams(self, codec_type: str) -> List[Dict[str, Any]]:
+        """
+        Returns the streams of the given type ("video", "audio", "subtitle", ...).
+        """
+        return [
+            stream for stream in self.streams if stream.get("codec_type") == codec_type
+        ]
+
+    @property
+    def codecs(self) -> List[str]:
+        return [stream.get("codec_name", "") for stream in self.streams]
+
+    @property
+    def has_video(self) -> bool:
+        return bool(self.get_streams("video"))
+
+    @property
+    def has_audio(self) -> bool:
+        return bool(self.get_streams("audio"))
+
+    @property
+    def has_subtitles(self) -> bool:
+        return bool(self.get_streams("subtitle"))
+
+
+def probe(video: Path) -> MediaInfo:
+    """
+    Probes a media file with ffprobe and returns its streams and format information.
+
+    The result is cached for as long as the file keeps the same size and
+    modification time, so callers can probe the same input as often as they like
+    while ffprobe only runs once.
+
+    Args:
+        video (Path): The path to the media file.
+
+    Returns:
+        MediaInfo: The probed information.
+    """
+    stat = video.stat()
+    return __probe(str(video), stat.st_size, stat.st_mtime_ns)
+
+
+@lru_cache(maxsize=256)
+def __probe(video: str, size: int, mtime: int) -> MediaInfo:
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-print_format",
+        "json",
+        "-show_streams",
+        "-show_format",
+        video,
+    ]
+    result = run(command, check=True, capture_output=True, text=True)
+    return MediaInfo(json.loads(result.stdout))
 
 
-def get_thumb(video: Path, timestamp: int) -> Path:
+@profiled("get_thumb")
+def get_thumb(video: Path, timestamp: int, target: Path | None = None) -> Path:
     """
     Extracts a thumbnail image from a video at a specified timestamp.
 
+    The timestamp is passed as an input option, so ffmpeg seeks to the closest
+    keyframe instead of decoding the video from the start.
+
     Args:
         video (Path): The path to the video file.
         timestamp (int): The timestamp (in seconds) at which to extract the thumbnail.
+        target (Path | None, optional): Where to write the image. Defaults to a new temporary file.
 
     Returns:
         Path: The path to the extracted thumbnail image.
     """
-    inputs = ["-i", f"{video}"]
-    target = NamedTemporaryFile(suffix=".jpeg").name
-    extract = [
-        "-ss",
-        str(timestamp),
-        "-vframes",
-        "1",
-    ]
-    output = [target]
+    if target is None:
+        with NamedTemporaryFile(suffix=".jpeg", delete=False) as temp_file:
+            target = Path(temp_file.name)
+    duration = probe(video).duration
+    if duration is not None and timestamp >= duration:
+        timestamp = int(duration / 2)
+    inputs = ["-ss", str(timestamp), "-i", f"{video}"]
+    extract = ["-frames:v", "1", "-f", "image2"]
+    output = [f"{target}"]
     command = ffmpeg + inputs + _metadata + extract + output
-    subprocess.run(command, check=True, capture_output=True)
-    return Path(target)
+    _run_ffmpeg(command, check=True, capture_output=True)
+    return target
+
+
+def get_cached_thumb(video: Path, timestamp: int, key: str) -> Path:
+    """
+    Returns the thumbnail of a video from the thumbnail cache, extracting it on a miss.
+
+    Args:
+        video (Path): The path to the video file.
+        timestamp (int): The timestamp (in seconds) at which to extract the thumbnail.
+        key (str): A key identifying the content of the video, e.g. its archive member and CRC.
+
+    Returns:
+        Path: The path to the cached thumbnail image.
+    """
+    digest = hashlib.sha256(f"{key}@{timestamp}".encode()).hexdigest()
+    thumbnail = CACHE / "thumbnails" / f"{digest}.jpeg"
+    if thumbnail.exists():
+        return thumbnail
+    thumbnail.parent.mkdir(parents=True, exist_ok=True)
+    with NamedTemporaryFile(dir=thumbnail.parent, suffix=".jpeg", delete=False) as temp:
+        extracted = Path(temp.name)
+    try:
+        get_thumb(video, timestamp, extracted)
+    except subprocess.CalledProcessError:
+        extracted.unlink()
+        raise
+    os.replace(extracted, thumbnail)
+    return thumbnail
 
 
 def has_embedded_subs(video: Path) -> bool:
@@ -55,16 +191,17 @@ def has_embedded_subs(video: Path) -> bool:
     Returns:
         bool: True if the video has embedded subtitles, False otherwise.
     """
-    result = subprocess.run(
-        ["ffprobe", f"{video}"],
-        capture_output=True,
-        check=True,
-        text=True,
-    )
-    return "subtitle" in result.stderr.lower()
+    return probe(video).has_subtitles
 
 
-def ffprocess(video: Path, target: Path, timestamp: int, subtitles: Path | None = None):
+@profiled("ffprocess")
+def ffprocess(
+    video: Path,
+    target: Path,
+    timestamp: int,
+    subtitles: Path | None = None,
+    thumbnail: Path | None = None,
+):
     """
     Processes a video file using ffmpeg, adding metadata, subtitles, and a thumbnail.
 
@@ -73,6 +210,8 @@ def ffprocess(video: Path, target: Path, timestamp: int, subtitles: Path | None
         target (Path): The path to the output video file.
         timestamp (int): The timestamp (in seconds) to capture the thumbnail.
         subtitles (Path | None, optional): The path to the subtitles file. Defaults to None.
+        thumbnail (Path | None, optional): A ready-made thumbnail to attach instead of
+                                           extracting one at the timestamp. Defaults to None.
 
     Returns:
         str: The stderr output from the ffmpeg command.
@@ -80,6 +219,7 @@ def ffprocess(video: Path, target: Path, timestamp: int, subtitles: Path | None
     inputs = ["-i", f"{video}"]
     if subtitles:
         inputs += ["-i", f"{subtitles}"]
+    embedded_subs = probe(video).has_subtitles
 
     title, comment = get_metadata(target)
     metadata = [
@@ -90,15 +230,18 @@ def ffprocess(video: Path, target: Path, timestamp: int, subtitles: Path | None
         "-metadata:s:a:0",
         "language=en",
     ]
-    if subtitles or has_embedded_subs(video):
+    if subtitles or embedded_subs:
         metadata += [
             "-metadata:s:s:0",
             "language=en",
         ]
 
-    thumbnail = [
+    temporary_thumb = thumbnail is None
+    if thumbnail is None:
+        thumbnail = get_thumb(video, timestamp)
+    attachment = [
         "-attach",
-        f"{get_thumb(video, timestamp)}",
+        f"{thumbnail}",
         "-metadata:s:t",
         f"filename={title}",
         "-metadata:s:t",
@@ -108,25 +251,29 @@ def ffprocess(video: Path, target: Path, timestamp: int, subtitles: Path | None
     mapping = ["-map", "0:v", "-map", "0:a"]
     if subtitles:
         mapping += ["-map", "1:s"]
-    elif has_embedded_subs(video):
+    elif embedded_subs:
         mapping += ["-map", "0:s"]
 
     codec = ["-c", "copy"]
-    if subtitles or has_embedded_subs(video):
+    if subtitles or embedded_subs:
         codec += ["-c:s", "srt"]
 
     output = [f"{target}"]
 
     command = (
-        ffmpeg + inputs + mapping + codec + _metadata + metadata + thumbnail + output
+        ffmpeg + inputs + mapping + codec + _metadata + metadata + attachment + output
     )
 
-    result = subprocess.run(
-        command,
-        check=True,
-        capture_output=True,
-        text=True,
-    )
+    try:
+        result = _run_ffmpeg(
+            command,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+    finally:
+        if temporary_thumb:
+            thumbnail.unlink(missing_ok=True)
     return result.stderr
 
 
@@ -146,41 +293,97 @@ def get_metadata(path: Path):
     return title, comment
 
 
-def get_blank_video(duration: int) -> Path:
+def get_blank_params(like: MediaInfo | None = None) -> Dict[str, Any]:
+    """
+    Returns the stream parameters of a blank video, copied from another video if given.
+
+    Args:
+        like (MediaInfo | None, optional): A video the blank video should match,
+                                           e.g. the lesson it is placed next to. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: The resolution, frame rate, pixel format and audio layout to encode with.
+    """
+    params: Dict[str, Any] = {
+        "width": 1920,
+        "height": 1080,
+        "fps": "30",
+        "pix_fmt": "yuv420p",
+        "sample_rate": 44100,
+        "channel_layout": "stereo",
+    }
+    videos = like.get_streams("video") if like else []
+    audios = like.get_streams("audio") if like else []
+    if videos:
+        video = videos[0]
+        params["width"] = video.get("width", params["width"])
+        params["height"] = video.get("height", params["height"])
+        for rate in (video.get("avg_frame_rate"), video.get("r_frame_rate")):
+            if rate and not rate.startswith("0/") and not rate.endswith("/0"):
+                params["fps"] = rate
+                break
+        if video.get("pix_fmt", "").startswith("yuv"):
+            params["pix_fmt"] = video["pix_fmt"]
+    if audios:
+        audio = audios[0]
+        params["sample_rate"] = int(audio.get("sample_rate", params["sample_rate"]))
+        if audio.get("channel_layout"):
+            params["channel_layout"] = audio["channel_layout"]
+    return params
+
+
+@profiled("get_blank_video")
+def get_blank_video(duration: int, like: MediaInfo | None = None) -> Path:
     """
-    Generates a blank video file of the specified duration.
+    Returns a blank video file of the specified duration from the blank video cache.
 
-    This function creates a temporary MP4 file containing a blank video with a black screen
-    and silent audio. The video has a resolution of 1920x1080 and uses the H.264 codec for
-    video and AAC codec for audio.
+    The video has a black screen and silent audio, encoded with H.264 and AAC. It
+    is stored under a hash of its duration, stream parameters and encoder
+    settings, so it is only encoded once; cold encodes use the fastest x264 preset.
+    The returned file is shared and must not be modified or deleted.
 
     Args:
         duration (int): The duration of the blank video in seconds.
+        like (MediaInfo | None, optional): A video whose resolution, frame rate and audio
+                                           the blank video should match. Defaults to 1080p at 30 fps.
 
     Returns:
-        Path: The file path to the generated blank video.
-    """
-    with NamedTemporaryFile(suffix=".mp4", delete=False) as temp_file:
-        blank_video = Path(temp_file.name)
-        command = ffmpeg + [
-            "-f",
-            "lavfi",
-            "-i",
-            f"color=c=black:s=1920x1080:d={duration}",
-            "-f",
-            "lavfi",
-            "-i",
-            f"anullsrc=r=44100:cl=stereo",
-            "-shortest",
-            "-vf",
-            "format=yuv420p",
-            "-c:v",
-            "libx264",
-            "-c:a",
-            "aac",
-            "-t",
-            str(duration),
-            str(blank_video),
-        ]
-        subprocess.run(command, check=True, capture_output=True)
+        Path: The file path to the blank video.
+    """
+    params = get_blank_params(like)
+    params.update(duration=duration, codecs=_blank_codecs)
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    blank_video = CACHE / "blank" / f"{digest}.mp4"
+    if blank_video.exists():
+        return blank_video
+
+    blank_video.parent.mkdir(parents=True, exist_ok=True)
+    with NamedTemporaryFile(
+        dir=blank_video.parent, suffix=".mp4", delete=False
+    ) as temp_file:
+        encoded = Path(temp_file.name)
+    size = f"{params['width']}x{params['height']}"
+    command = ffmpeg + [
+        "-f",
+        "lavfi",
+        "-i",
+        f"color=c=black:s={size}:r={params['fps']}:d={duration}",
+        "-f",
+        "lavfi",
+        "-i",
+        f"anullsrc=r={params['sample_rate']}:cl={params['channel_layout']}",
+        "-shortest",
+        "-vf",
+        f"format={params['pix_fmt']}",
+        *_blank_codecs,
+        "-t",
+        str(duration),
+        str(encoded),
+    ]
+    try:
+        _run_ffmpeg(command, check=True, capture_output=True)
+    except subprocess.CalledProcessError:
+        encoded.unlink()
+        raise
+    os.replace(encoded, blank_video)
     return blank_video
@@ -1,5 +1,6 @@
 from pathlib import Path
 
+from archive import MergedZip
 from utils.archive import merge_zips
 
 mappings = {
@@ -68,6 +69,6 @@ def fix_names(path: Path) -> Path:
     return path
 
 
-def main(*archives: Path) -> Path:
+def main(*archives: Path) -> Path | MergedZip:
     merged = merge_zips(*archives, post_process=fix_names)
     return merged
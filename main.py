@@ -1,15 +1,24 @@
 import argparse
 import json
+import shutil
+import time
+import traceback
+from contextlib import ExitStack, contextmanager
 from importlib import import_module
 from importlib.util import find_spec
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, NamedTuple, Tuple
 
-from course import CourseSerializer
-from utils.archive import extract_non_videos, extract_videos, merge_zips
-from utils.configs import DOWNLOADS, HOME
-from utils.download import download_archive, download_magnet, gdrive_direct_download_url
-from utils.general import copy_to_clipboard
+from utils import profile
+from utils.configs import HOME, MAX_CONNECTIONS
+from utils.pool import download_budget, ffmpeg_budget, imap_ordered
+
+# The modules doing the actual work pull in requests, bs4, yt_dlp, seedrcc, ...
+# They are imported by the functions that need them, so that --help and
+# --list-configs start instantly.
+if TYPE_CHECKING:
+    from archive import ArchiveView
+    from utils.manifest import CompletionManifest
 
 
 def list_configs(courses: Dict[str, Any]) -> None:
@@ -28,6 +37,8 @@ def list_configs(courses: Dict[str, Any]) -> None:
 
 
 def load_hook(config: str):
+    from utils.archive import merge_zips
+
     hook_module = f"hooks.{config}"
     if find_spec(hook_module):
         hook = import_module(hook_module).main
@@ -36,36 +47,169 @@ def load_hook(config: str):
     return hook
 
 
+def prepare_part(
+    magnet: str, quiet: bool = False, folder_of: Callable[[str], int] | None = None
+) -> Callable[[str, int], Path]:
+    """
+    Prepares the acquisition of one part of a course.
+
+    Any manual input the part needs is asked for right away, so that the returned
+    function can run alongside the downloads of the other parts.
+
+    Args:
+        magnet (str): A magnet link, a Google Drive file ID or the path to a local file.
+        quiet (bool, optional): Download magnets through Seedr instead of asking for a link. Defaults to False.
+        folder_of (Callable[[str], int] | None, optional): Gives the Seedr folder of a magnet
+                                                          added together with the other parts.
+                                                          Defaults to None.
+
+    Returns:
+        Callable[[str, int], Path]: A function taking a progress label and a number of
+                                    connections, and returning the path to the part.
+    """
+    from utils.download import download_archive, download_magnet, open_gdrive_download
+    from utils.general import copy_to_clipboard
+
+    if Path(magnet).expanduser().exists():
+        return lambda desc, connections: Path(magnet).expanduser()
+    if not magnet.startswith("magnet:"):
+        return lambda desc, connections: download_archive(
+            open_gdrive_download(magnet), connections=connections, key=magnet, desc=desc
+        )
+    if quiet:
+        return lambda desc, connections: download_magnet(
+            magnet,
+            connections,
+            desc,
+            quiet=True,
+            folder_id=folder_of(magnet) if folder_of else None,
+        )
+    copy_to_clipboard(magnet, quiet=True)
+    url = input("Download Link: ")
+    return lambda desc, connections: download_archive(
+        url, connections=connections, desc=desc
+    )
+
+
+def download_parts(magnets: List[str], quiet: bool = False) -> Iterator[Path]:
+    """
+    Downloads all the parts of a course at once.
+
+    Args:
+        magnets (List[str]): The magnet links, Google Drive file IDs or local paths of the parts.
+        quiet (bool, optional): Disable manual interactions. Defaults to False.
+
+    Yields:
+        Path: Each part, in order, as soon as it and every part before it are ready.
+    """
+    from utils.download import add_magnets
+
+    links = [magnet for magnet in magnets if magnet.startswith("magnet:")]
+    # a single tracker follows every torrent of the course
+    folder_of = add_magnets(links, quiet=True) if quiet and len(links) > 1 else None
+    # ask for every manual input up front, then download all the parts at once
+    parts = [prepare_part(magnet, quiet, folder_of) for magnet in magnets]
+    connections = max(1, MAX_CONNECTIONS // len(parts))
+
+    def acquire(part: Tuple[int, Callable[[str, int], Path]]) -> Path:
+        index, download = part
+        with download_budget:
+            return download(f"Part {index}/{len(parts)}", connections)
+
+    yield from imap_ordered(acquire, enumerate(parts, 1), len(parts))
+
+
+def find_local_parts(config: str, input_archive: List[str] = []) -> List[Path]:
+    """
+    Returns the parts of a course given on the command line or found in DOWNLOADS.
+    """
+    from utils.configs import DOWNLOADS
+
+    if input_archive:
+        return [Path(file) for file in input_archive]
+    if (DOWNLOADS / f"{config}.zip").exists():
+        return [DOWNLOADS / f"{config}.zip"]
+    if (DOWNLOADS / config).is_dir():
+        files = [file for file in (DOWNLOADS / config).iterdir()]
+        files.sort()
+        return files
+    return []
+
+
+def remove_download(magnet: str, part: Path) -> None:
+    """
+    Deletes the directory download_magnet created in TEMP for a part, once the
+    part was extracted. Local parts and downloaded archives are kept.
+    """
+    if magnet.startswith("magnet:") and part.is_dir():
+        shutil.rmtree(part, ignore_errors=True)
+
+
+@contextmanager
 def get_source(
     config: str,
     course_data: dict[str, Any],
     input_archive: List[str] = [],
     quiet: bool = False,
-):
+) -> "Iterator[Path | ArchiveView]":
     hook = load_hook(config)
-    if input_archive:
-        return hook(*[Path(file) for file in input_archive])
-    if (DOWNLOADS / f"{config}.zip").exists():
-        return hook(DOWNLOADS / f"{config}.zip")
-    if (DOWNLOADS / config).is_dir():
-        files = [file for file in (DOWNLOADS / config).iterdir()]
-        files.sort()
-        return hook(*files)
+    files = find_local_parts(config, input_archive)
+    magnets: List[str] = []
+    if not files:
+        magnets = course_data["magnets"]
+        files = list(download_parts(magnets, quiet))
+    try:
+        yield hook(*files)
+    finally:
+        for magnet, part in zip(magnets, files):
+            remove_download(magnet, part)
 
-    magnets = course_data["magnets"]
-    files: List[Path] = []
-    for magnet in magnets:
-        if not magnet.startswith("magnet:"):
-            url = gdrive_direct_download_url(magnet)
-            files.append(download_archive(url))
-            continue
-        if quiet:
-            files.append(download_magnet(magnet))
-            continue
-        copy_to_clipboard(magnet, quiet=True)
-        files.append(download_archive(input("Download Link: ")))
 
-    return hook(*files)
+def process_source(
+    source: "Path | ArchiveView",
+    target_list: Iterator[Path],
+    target_dir: Path,
+    manifest: "CompletionManifest",
+    intro: int = 0,
+    others: int = 0,
+    jobs: int = 1,
+) -> None:
+    """
+    Extracts the videos and the other files of a course, or of one part of it.
+
+    Args:
+        source (Path | ArchiveView): The archive to extract.
+        target_list (Iterator[Path]): The targets of the videos, of which as many are
+                                      consumed as the archive has videos.
+        target_dir (Path): The output directory of the course.
+        manifest (CompletionManifest): The completion manifest of the course.
+        intro (int, optional): Timestamp for thumbnails of intro videos. Defaults to 0.
+        others (int, optional): Timestamp for thumbnails of other videos. Defaults to 0.
+        jobs (int, optional): Number of lessons to process in parallel. Defaults to 1.
+    """
+    from archive import open_archive
+    from utils.archive import extract_non_videos, extract_videos
+
+    with open_archive(source) as archive:
+        extract_videos(
+            archive,
+            target_list,
+            ffmpeg=True,
+            intro=intro,
+            others=others,
+            jobs=jobs,
+            manifest=manifest,
+        )
+        extract_non_videos(archive, target_dir, manifest)
+
+
+class CourseResult(NamedTuple):
+    """The outcome of processing one course in a batch."""
+
+    config: str
+    files: int
+    seconds: float
+    error: str | None
 
 
 def main() -> None:
@@ -74,7 +218,13 @@ def main() -> None:
         description="Organizes courses from codewithmosh.com",
         epilog="Checkout https://codewithmosh.com",
     )
-    parser.add_argument("config", type=str, nargs="?", help="The configuration to use")
+    parser.add_argument("config", type=str, nargs="*", help="The configurations to use")
+    parser.add_argument(
+        "-a",
+        "--all",
+        action="store_true",
+        help="Process every available configuration",
+    )
     parser.add_argument(
         "-l",
         "--list-configs",
@@ -90,6 +240,39 @@ def main() -> None:
         action="store_true",
         help="Disable manual interactions",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of lessons to process in parallel, across all courses",
+    )
+    parser.add_argument(
+        "-c",
+        "--courses",
+        type=int,
+        default=1,
+        help="Number of courses to process in parallel",
+    )
+    parser.add_argument(
+        "-d",
+        "--downloads",
+        type=int,
+        help="Maximum number of parts downloaded at once, across all courses",
+    )
+    parser.add_argument(
+        "-p",
+        "--pipeline",
+        action="store_true",
+        help="Process each part as soon as it is downloaded",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        nargs="?",
+        const=Path("profile.json"),
+        help="Write a trace of the run (Chrome trace, or JSON lines for .jsonl files)",
+    )
     args = parser.parse_args()
 
     config_file = Path("data.json")
@@ -100,21 +283,137 @@ def main() -> None:
         list_configs(courses)
         parser.exit()
 
-    if not args.config:
+    configs: List[str] = sorted(courses) if args.all else args.config
+    if not configs:
         parser.error("The following arguments are required: config")
+    unknown = [config for config in configs if config not in courses]
+    if unknown:
+        parser.error(f"Unknown configurations: {', '.join(unknown)}")
+    if min(args.jobs, args.courses, args.downloads or 1) < 1:
+        parser.error("The number of jobs, courses and downloads must be at least 1")
+    if len(configs) > 1 and args.input_archive:
+        parser.error("An input archive can only be used with a single configuration")
+    if args.courses > 1 and not args.quiet:
+        parser.error("Processing several courses at once requires --quiet")
+
+    ffmpeg_budget.set_limit(args.jobs)
+    download_budget.set_limit(args.downloads)
+    if args.profile:
+        profile.enable()
+    try:
+        if len(configs) == 1:
+            run(args, configs[0], courses[configs[0]], data["templates"])
+        else:
+            results = run_batch(args, configs, data)
+            print(f"\n{summarize(results)}")
+            if any(result.error for result in results):
+                parser.exit(1)
+    finally:
+        if args.profile:
+            profile.write_trace(args.profile)
+            print(f"\n{profile.summary()}\nTrace written to {args.profile}")
+
 
-    course_data = courses[args.config]
+def run_batch(
+    args: argparse.Namespace, configs: List[str], data: Dict[str, Any]
+) -> List[CourseResult]:
+    """
+    Processes several courses in one process, `args.courses` at a time.
+
+    The courses share the network session, the metadata cache and the download
+    and ffmpeg budgets. A course that fails is reported without stopping the others.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+        configs (List[str]): The configurations to process.
+        data (Dict[str, Any]): The contents of data.json.
+
+    Returns:
+        List[CourseResult]: The outcome of every course, in the order of the configurations.
+    """
+
+    def process(config: str) -> CourseResult:
+        start = time.perf_counter()
+        try:
+            files = run(args, config, data["configs"][config], data["templates"])
+        except Exception as error:
+            traceback.print_exc()
+            return CourseResult(config, 0, time.perf_counter() - start, repr(error))
+        return CourseResult(config, files, time.perf_counter() - start, None)
+
+    return list(imap_ordered(process, configs, args.courses))
+
+
+def summarize(results: List[CourseResult]) -> str:
+    lines = [f"{'config':<32}{'files':>7}{'seconds':>10}  status"]
+    for result in results:
+        status = f"failed: {result.error}" if result.error else "done"
+        lines.append(
+            f"{result.config:<32}{result.files:>7}{result.seconds:>10.1f}  {status}"
+        )
+    return "\n".join(lines)
+
+
+def run(
+    args: argparse.Namespace,
+    config: str,
+    course_data: Dict[str, Any],
+    templates: List[List[int]],
+) -> int:
+    """
+    Acquires the parts of a course and organizes them into the course directory.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+        config (str): The configuration of the course.
+        course_data (Dict[str, Any]): The data of the configuration.
+        templates (List[List[int]]): The thumbnail timestamps of every template.
+
+    Returns:
+        int: The number of files written for the course, now or in earlier runs.
+    """
+    from archive import MergedZip
+    from course import CourseSerializer
+    from utils.archive import merge_zips
+    from utils.manifest import CompletionManifest
 
     slug, template_id, *others = course_data.values()
-    intro, others = data["templates"][template_id]
+    intro, others = templates[template_id]
 
-    source = get_source(args.config, course_data, args.input_archive, args.quiet)
+    local = find_local_parts(config, args.input_archive)
+    if not local and not course_data["magnets"]:
+        raise FileNotFoundError(f"No source found for {config}")
+    # parts can only be processed one by one when no hook needs the whole course
+    pipelined = args.pipeline and load_hook(config) is merge_zips and not local
+    with ExitStack() as stack:
+        if not pipelined:
+            source = stack.enter_context(
+                get_source(config, course_data, args.input_archive, args.quiet)
+            )
 
-    course = CourseSerializer.get_course(slug)
-    target = HOME / "Programming Videos"
-    target_list = course.get_videos(target)
-    extract_videos(source, target_list, ffmpeg=True, intro=intro, others=others)
-    extract_non_videos(source, target / str(course))
+        course = CourseSerializer.get_course(slug)
+        target = HOME / "Programming Videos"
+        target_list = course.get_videos(target)
+        manifest = CompletionManifest(target / str(course))
+        options = {"intro": intro, "others": others, "jobs": args.jobs}
+        if not pipelined:
+            process_source(
+                source, target_list, target / str(course), manifest, **options
+            )
+            return manifest.count
+
+    magnets = course_data["magnets"]
+    parts = download_parts(magnets, args.quiet)
+    for index, (magnet, part) in enumerate(zip(magnets, parts)):
+        # name the members exactly like merge_zips would for the whole course
+        source = merge_zips(part) if len(magnets) == 1 else MergedZip(part, start=index)
+        try:
+            process_source(
+                source, target_list, target / str(course), manifest, **options
+            )
+        finally:
+            remove_download(magnet, part)
+    return manifest.count
 
 
 if __name__ == "__main__":
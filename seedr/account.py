@@ -1,13 +1,12 @@
-import json
 import webbrowser
 from pathlib import Path
-from time import sleep, time
+from threading import Lock
+from time import sleep
 from typing import Any, Dict, List, cast
-from urllib.parse import ParseResult, parse_qs, urlparse
 
-import requests
 from seedrcc import Login, Seedr  # type: ignore
 
+from seedr.torrent import TorrentTracker
 from utils.general import copy_to_clipboard
 
 
@@ -15,6 +14,16 @@ class SeedrAccount:
     """Represents a seedr.cc user account."""
 
     token_file = Path.home() / ".cache" / "codewithmosh" / "token.txt"
+    __shared: "SeedrAccount | None" = None
+    __shared_lock = Lock()
+
+    @classmethod
+    def shared(cls) -> "SeedrAccount":
+        """Return the account shared by the whole process, logging in on first use."""
+        with cls.__shared_lock:
+            if SeedrAccount.__shared is None:
+                SeedrAccount.__shared = cls()
+            return SeedrAccount.__shared
 
     def __init__(self) -> None:
         self.token = self.__read_token()
@@ -51,27 +60,16 @@ class SeedrAccount:
         """Get a list of active torrents."""
         return self.list_contents()["torrents"]
 
-    def add_torrent(self, magnet_link: str) -> int:
-        """Add torrent by its magnet link."""
-        start_time = time()
-
-        torrent_id = cast(
-            Dict[Any, Any],
-            self.account.addTorrent(magnet_link),  # type: ignore
-        )["user_torrent_id"]
-        torrents = self.get_torrents()
-        fetched: bool = bool(torrents and torrents[0]["id"] == torrent_id)
-        torrent = torrents[0] if fetched else None
-
-        while True:
-            sleep(2)
-            if not self.get_torrents():
-                if torrent:
-                    return self.__get_id_from_torrent(torrent)
-                return self.get_latest_folder_id()
+    def add_torrent(self, magnet_link: str, quiet: bool = False) -> int:
+        """Add torrent by its magnet link and return the folder it creates."""
+        return self.add_torrents([magnet_link], quiet)[0]
 
-            if (time() - start_time) > 60:
-                raise TimeoutError("It's taking too long...")
+    def add_torrents(self, magnet_links: List[str], quiet: bool = False) -> List[int]:
+        """Add several torrents at once and return the folders they create, in order."""
+        tracker = TorrentTracker(self)
+        torrent_ids = [tracker.add(magnet_link) for magnet_link in magnet_links]
+        folder_ids = tracker.wait(quiet)
+        return [folder_ids[torrent_id] for torrent_id in torrent_ids]
 
     def get_latest_folder_id(self) -> int:
         """Get the folder id for the last added folder."""
@@ -106,19 +104,6 @@ class SeedrAccount:
             return self.token_file.read_text()
         return self.login()
 
-    def __get_id_from_torrent(self, torrent: Dict[Any, Any]) -> int:
-        progress_url = torrent["progress_url"]
-        parsed = cast(ParseResult, urlparse(progress_url))
-        url = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
-
-        queries = parse_qs(parsed.query)
-        params = {key: value[0] for key, value in queries.items()}
-
-        response = requests.get(url, params=params)
-        torrent_info = json.loads(response.text.strip("?()"))
-        folder_id = torrent_info["stats"]["folder_created"]
-        return folder_id
-
     def __update_token(self, token: str) -> None:
         self.token_file.parent.mkdir(parents=True, exist_ok=True)
         self.token_file.write_text(token)
@@ -1,17 +1,34 @@
-from typing import Iterable
+from functools import cached_property
+from typing import Any, Dict, Iterable, List
 
 from seedr.account import SeedrAccount
+from utils.configs import MAX_CONNECTIONS
+from utils.pool import imap_ordered
 
 
 class SeedrFile:
-    def __init__(self, file_id: int) -> None:
-        self.account = SeedrAccount()
+    def __init__(
+        self,
+        file_id: int,
+        account: SeedrAccount | None = None,
+        info: Dict[Any, Any] | None = None,
+    ) -> None:
+        self.account = account or SeedrAccount.shared()
         self.id = file_id
-        self.__file_info = self.account.fetch_file(self.id)
+        self.__file_info = (
+            info if info is not None else self.account.fetch_file(self.id)
+        )
         self.name = self.__file_info["name"]
-        self.url = self.__file_info["url"]
+        self.size: int | None = self.__file_info.get("size")
         self.path = ""
 
+    @cached_property
+    def url(self) -> str:
+        """The download URL of the file, resolved on first access."""
+        if "url" not in self.__file_info:
+            self.__file_info = self.account.fetch_file(self.id)
+        return self.__file_info["url"]
+
     def set_path(self, path: str = "") -> None:
         self.path = path
 
@@ -20,10 +37,18 @@ class SeedrFile:
 
 
 class SeedrFolder:
-    def __init__(self, folder_id: int = 0) -> None:
-        self.account = SeedrAccount()
+    def __init__(
+        self,
+        folder_id: int = 0,
+        account: SeedrAccount | None = None,
+        contents: Dict[Any, Any] | None = None,
+    ) -> None:
+        self.account = account or SeedrAccount.shared()
         self.id = folder_id
-        self.__contents = self.account.list_contents(self.id)
+        self.__contents = (
+            contents if contents is not None else self.account.list_contents(self.id)
+        )
+        self.__subfolders: List["SeedrFolder"] | None = None
         self.name = self.__get_name()
         self.path = self.__contents["fullname"]
 
@@ -32,19 +57,45 @@ class SeedrFolder:
         return name if name else "root"
 
     def get_subfolders(self) -> Iterable["SeedrFolder"]:
-        folders = self.__contents["folders"]
-        return (SeedrFolder(folder["id"]) for folder in folders)
+        return self.__list_subfolders([self])
 
     def get_files(self) -> Iterable[SeedrFile]:
         files = self.__contents["files"]
-        return (SeedrFile(file["folder_file_id"]) for file in files)
+        return (SeedrFile(file["folder_file_id"], self.account, file) for file in files)
 
     def traverse(self) -> Iterable[SeedrFile]:
+        self.prefetch()
         for file in self.get_files():
             file.set_path(f"{self.path}/{file.name}")
             yield file
         for folder in self.get_subfolders():
             yield from folder.traverse()
 
+    def prefetch(self) -> None:
+        """
+        Lists every folder below this one ahead of a traversal, one level of the
+        tree at a time, with the folders of a level listed concurrently.
+        """
+        level: List[SeedrFolder] = [self]
+        while level:
+            level = self.__list_subfolders(level)
+
+    def __list_subfolders(self, folders: List["SeedrFolder"]) -> List["SeedrFolder"]:
+        """
+        Lists the subfolders of the given folders that haven't been listed yet,
+        concurrently, and returns the subfolders of all of them.
+        """
+        pending = [folder for folder in folders if folder.__subfolders is None]
+        ids = [
+            entry["id"] for folder in pending for entry in folder.__contents["folders"]
+        ]
+        listings = iter(imap_ordered(self.account.list_contents, ids, MAX_CONNECTIONS))
+        for folder in pending:
+            folder.__subfolders = [
+                SeedrFolder(entry["id"], self.account, next(listings))
+                for entry in folder.__contents["folders"]
+            ]
+        return [child for folder in folders for child in folder.__subfolders or []]
+
     def __str__(self) -> str:
         return self.name
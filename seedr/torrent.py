@@ -0,0 +1,233 @@
+import json
+from time import monotonic, sleep
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, cast
+from urllib.parse import ParseResult, parse_qs, urlparse
+
+from tqdm import tqdm
+
+from utils.configs import MAX_CONNECTIONS
+from utils.network import get_session
+from utils.pool import imap_ordered
+
+if TYPE_CHECKING:
+    from seedr.account import SeedrAccount
+
+
+class TorrentStatus(NamedTuple):
+    """The state of a torrent tracked by a TorrentTracker."""
+
+    id: int
+    title: str
+    progress: float
+    eta: float | None
+    folder_id: int | None
+
+
+class TorrentTracker:
+    """
+    Tracks torrents added to a seedr.cc account until their folders are ready.
+
+    Every torrent is followed through its own progress URL, so several torrents
+    can be staged at once and each torrent ID is mapped to the folder it created.
+    Polling starts every `min_interval` seconds and backs off up to `max_interval`
+    seconds, depending on the estimated time left and on whether progress is made.
+
+    Args:
+        account (SeedrAccount): The account the torrents are added to.
+        min_interval (float, optional): The shortest time between two polls. Defaults to 2.
+        max_interval (float, optional): The longest time between two polls. Defaults to 30.
+        stall_timeout (float, optional): How long a torrent may go without progress. Defaults to 30 minutes.
+
+    Methods:
+        add(magnet_link: str) -> int:
+            Adds a torrent and starts tracking it.
+
+        poll() -> List[TorrentStatus]:
+            Refreshes and returns the state of every tracked torrent.
+
+        wait(quiet: bool = False) -> Dict[int, int]:
+            Polls until every torrent is ready and returns their folder ids.
+    """
+
+    def __init__(
+        self,
+        account: "SeedrAccount",
+        min_interval: float = 2,
+        max_interval: float = 30,
+        stall_timeout: float = 30 * 60,
+    ) -> None:
+        self.account = account
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stall_timeout = stall_timeout
+        self.__torrents: Dict[int, Dict[str, Any]] = {}
+
+    def add(self, magnet_link: str) -> int:
+        """
+        Adds a torrent by its magnet link and starts tracking it.
+
+        Returns:
+            int: The id of the torrent.
+        """
+        response = cast(
+            Dict[Any, Any],
+            self.account.account.addTorrent(magnet_link),  # type: ignore
+        )
+        torrent_id = response["user_torrent_id"]
+        self.__torrents[torrent_id] = {
+            "title": response.get("title", ""),
+            "progress_url": None,
+            "progress": 0.0,
+            "eta": None,
+            "folder_id": None,
+            "changed": monotonic(),
+        }
+        return torrent_id
+
+    def poll(self) -> List[TorrentStatus]:
+        """
+        Refreshes the state of every tracked torrent that isn't ready yet.
+
+        Returns:
+            List[TorrentStatus]: The state of every tracked torrent.
+        """
+        pending = {
+            torrent_id: torrent
+            for torrent_id, torrent in self.__torrents.items()
+            if torrent["folder_id"] is None
+        }
+        if pending:
+            active = {torrent["id"]: torrent for torrent in self.account.get_torrents()}
+            for torrent_id, torrent in pending.items():
+                if torrent_id in active:
+                    torrent["progress_url"] = active[torrent_id]["progress_url"]
+                elif torrent["progress_url"] is None:
+                    # finished before it ever showed up in the list of torrents
+                    torrent["folder_id"] = self.__find_folder(torrent["title"])
+                    torrent["progress"] = 100.0
+            tracked = [
+                (torrent_id, torrent)
+                for torrent_id, torrent in pending.items()
+                if torrent["folder_id"] is None
+            ]
+            urls = [torrent["progress_url"] for _, torrent in tracked]
+            infos = imap_ordered(self.__get_progress, urls, MAX_CONNECTIONS)
+            for (torrent_id, torrent), info in zip(tracked, infos):
+                self.__update(torrent, info, torrent_id not in active)
+        return self.statuses()
+
+    def statuses(self) -> List[TorrentStatus]:
+        """Returns the last known state of every tracked torrent."""
+        return [
+            TorrentStatus(
+                torrent_id,
+                torrent["title"],
+                torrent["progress"],
+                torrent["eta"],
+                torrent["folder_id"],
+            )
+            for torrent_id, torrent in self.__torrents.items()
+        ]
+
+    def wait(self, quiet: bool = False) -> Dict[int, int]:
+        """
+        Polls until every tracked torrent is ready.
+
+        Args:
+            quiet (bool, optional): Don't show progress bars. Defaults to False.
+
+        Returns:
+            Dict[int, int]: The id of the folder created by each torrent, by torrent id.
+
+        Raises:
+            TimeoutError: If a torrent makes no progress for `stall_timeout` seconds.
+        """
+        bars = {
+            torrent_id: tqdm(
+                total=100, desc=torrent["title"] or str(torrent_id), disable=quiet
+            )
+            for torrent_id, torrent in self.__torrents.items()
+        }
+        interval = self.min_interval
+        try:
+            while True:
+                statuses = self.poll()
+                for status in statuses:
+                    bar = bars[status.id]
+                    bar.update(status.progress - bar.n)
+                    if status.eta is not None:
+                        bar.set_postfix(eta=f"{status.eta:.0f}s")
+                if all(status.folder_id is not None for status in statuses):
+                    return {
+                        status.id: cast(int, status.folder_id) for status in statuses
+                    }
+                self.__check_stalled()
+                interval = self.__next_interval(statuses, interval)
+                sleep(interval)
+        finally:
+            for bar in bars.values():
+                bar.close()
+
+    def __next_interval(self, statuses: List[TorrentStatus], interval: float) -> float:
+        etas = [
+            status.eta
+            for status in statuses
+            if status.folder_id is None and status.eta is not None
+        ]
+        if etas:
+            # poll a few times before the first torrent is expected to finish
+            interval = min(etas) / 4
+        else:
+            interval *= 1.5
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def __check_stalled(self) -> None:
+        now = monotonic()
+        for torrent in self.__torrents.values():
+            if torrent["folder_id"] is not None:
+                continue
+            if now - torrent["changed"] > self.stall_timeout:
+                raise TimeoutError(f"{torrent['title']} is not making progress...")
+
+    def __update(
+        self, torrent: Dict[str, Any], info: Dict[Any, Any], finished: bool
+    ) -> None:
+        now = monotonic()
+        folder_id = info.get("stats", {}).get("folder_created")
+        if folder_id:
+            torrent["folder_id"] = folder_id
+            torrent["progress"] = 100.0
+            torrent["eta"] = 0.0
+            return
+        if finished:
+            torrent["folder_id"] = self.__find_folder(torrent["title"])
+            torrent["progress"] = 100.0
+            return
+        progress = float(info.get("progress", torrent["progress"]) or 0)
+        if progress > torrent["progress"]:
+            rate = (progress - torrent["progress"]) / max(
+                now - torrent["changed"], 1e-3
+            )
+            torrent["eta"] = (100 - progress) / rate
+            torrent["progress"] = progress
+            torrent["changed"] = now
+        torrent["title"] = info.get("title") or torrent["title"]
+
+    def __find_folder(self, title: str) -> int:
+        folders = self.account.list_contents()["folders"]
+        matches = [folder["id"] for folder in folders if folder["name"] == title]
+        if not matches:
+            # guessing the newest folder could pick the one of another torrent
+            raise KeyError(f"No folder was found for the torrent {title!r}.")
+        return max(matches)
+
+    @staticmethod
+    def __get_progress(progress_url: str) -> Dict[Any, Any]:
+        parsed = cast(ParseResult, urlparse(progress_url))
+        url = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
+
+        queries = parse_qs(parsed.query)
+        params = {key: value[0] for key, value in queries.items()}
+
+        response = get_session().get(url, params=params)
+        return json.loads(response.text.strip("?()"))
@@ -1,85 +1,174 @@
+import hashlib
+import os
 import shutil
-import zipfile
-from pathlib import Path
+import struct
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from pathlib import Path, PurePosixPath
 from tempfile import NamedTemporaryFile, TemporaryDirectory
-from typing import Callable, Iterator, Optional
-from zipfile import BadZipFile, ZipFile
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from zipfile import (
+    ZIP64_LIMIT,
+    BadZipFile,
+    ZipFile,
+    ZipInfo,
+    sizeFileHeader,
+    stringFileHeader,
+    structFileHeader,
+)
 
-from natsort import natsorted
 from tqdm import tqdm
 
-from archive import MoshZip
-from ffmpeg import ffprocess
-from utils.configs import TEMP
-from utils.general import clean_path
+from archive import ArchiveEntry, ArchiveView, MergedZip, MoshZip, open_archive
+from ffmpeg import MediaInfo, ffprocess, get_blank_video, get_cached_thumb, probe
+from utils.cache import DiskCache
+from utils.configs import BUFFER_SIZE, CACHE, MAX_WORKERS, TEMP
+from utils.general import clean_path, copy_stream
+from utils.manifest import CompletionManifest
+from utils.pool import imap_ordered
+from utils.profile import count, profiled, span
 
+# ffprobe results of archive members, by content key
+_media_cache = DiskCache(CACHE / "media")
 
+
+@contextmanager
+def _borrow(source: Path | ArchiveView) -> Iterator[ArchiveView]:
+    """
+    Opens the given archive, closing it afterwards only if it was opened here.
+    """
+    archive = open_archive(source)
+    try:
+        yield archive
+    finally:
+        if archive is not source:
+            archive.close()
+
+
+@profiled("extract_videos")
 def extract_videos(
-    archive: Path,
+    archive: Path | ArchiveView,
     target_list: Iterator[Path],
     ffmpeg: bool = False,
     intro: int = 0,
     others: int = 0,
+    jobs: int = 1,
+    manifest: CompletionManifest | None = None,
 ) -> None:
     """
     Extracts video files from a given archive and processes them.
     Args:
-        archive (Path): The path to the archive file containing the videos.
+        archive (Path | ArchiveView): The archive containing the videos, either as a path or an opened view.
         target_list (Iterator[Path]): An iterator of target paths where the extracted videos will be saved.
         ffmpeg (bool, optional): If True, use ffmpeg to process the videos. Defaults to False.
         intro (int, optional): Timestamp thumbnails of intro videos. Defaults to 0.
         others (int, optional): Timestamp for thumbnails of other videos. Defaults to 0.
+        jobs (int, optional): Number of lessons to process in parallel. Defaults to 1.
+        manifest (CompletionManifest | None, optional): Skips the videos it records as complete
+                                                        and records the ones written now. Defaults to None.
     Returns:
         None
     """
 
-    with MoshZip(archive) as zip_ref:
-        archived_videos = zip_ref.namelist_from_ext(".mp4", ".mkv")
+    with _borrow(archive) as zip_ref:
+        lessons = list(zip(zip_ref.manifest["video"], target_list))
+        if manifest:
+            lessons = _pending(lessons, manifest)
+        process = partial(_extract_video, zip_ref, ffmpeg, intro, others)
         print("Processing videos...")
-        for video_path, target in tqdm(list(zip(archived_videos, target_list))):
-            archived_video = zip_ref.open(video_path)
-            archived_path = Path(archived_video.name)
-            subtitles = zip_ref.extract_subtitles(video_path)
-            target.parent.mkdir(parents=True, exist_ok=True)
-            if ffmpeg:
-                with NamedTemporaryFile(suffix=archived_path.suffix) as temp:
-                    video = Path(temp.name)
-                    video.write_bytes(archived_video.read())
-                    timestamp = intro if target.name.startswith("01") else others
-                    ffprocess(video, target, timestamp, subtitles)
-            else:
-                target.write_bytes(archived_video.read())
+        results = imap_ordered(process, lessons, jobs)
+        for (entry, target), (subtitles, digest) in tqdm(
+            zip(lessons, results), total=len(lessons)
+        ):
             if subtitles:
-                target.with_suffix(subtitles.suffix).write_bytes(subtitles.read_bytes())
+                shutil.copyfile(subtitles, target.with_suffix(subtitles.suffix))
+            if manifest:
+                manifest.record(target, entry, digest)
+
 
+def _pending(
+    lessons: List[Tuple[ArchiveEntry, Path]], manifest: CompletionManifest
+) -> List[Tuple[ArchiveEntry, Path]]:
+    pending = [
+        (entry, target)
+        for entry, target in lessons
+        if not manifest.is_complete(target, entry)
+    ]
+    if len(pending) < len(lessons):
+        print(f"Skipping {len(lessons) - len(pending)} completed file(s)...")
+    return pending
 
-def extract_non_videos(source: Path, target_dir: Path) -> None:
+
+def _extract_video(
+    zip_ref: ArchiveView,
+    ffmpeg: bool,
+    intro: int,
+    others: int,
+    lesson: Tuple[ArchiveEntry, Path],
+) -> Tuple[Path | None, str]:
+    entry, target = lesson
+    video_path = entry.name
+    subtitles = zip_ref.extract_subtitles(video_path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if ffmpeg:
+        with NamedTemporaryFile(suffix=Path(video_path).suffix) as temp:
+            with span("copy_member", member=video_path):
+                video = zip_ref.copy_member(video_path, Path(temp.name))
+            count("bytes copied to temp", entry.size)
+            timestamp = intro if target.name.startswith("01") else others
+            key = zip_ref.content_key(entry)
+            thumbnail = get_cached_thumb(video, timestamp, key)
+            ffprocess(video, target, timestamp, subtitles, thumbnail)
+        # ffmpeg writes the target itself, so hash it while it is still in the page cache
+        with target.open("rb") as output:
+            digest = hashlib.file_digest(output, "sha256").hexdigest()
+    else:
+        hasher = hashlib.sha256()
+        zip_ref.copy_member(video_path, target, hasher=hasher)
+        digest = hasher.hexdigest()
+    return subtitles, digest
+
+
+@profiled("extract_non_videos")
+def extract_non_videos(
+    source: Path | ArchiveView,
+    target_dir: Path,
+    manifest: CompletionManifest | None = None,
+) -> None:
     """
     Extracts non-video files (e.g., .zip, .pdf) from a given zip archive to a target directory.
 
     Args:
-        source (Path): The path to the source zip file.
+        source (Path | ArchiveView): The source archive, either as a path or an opened view.
         target_dir (Path): The directory where the extracted files will be saved.
+        manifest (CompletionManifest | None, optional): Skips the files it records as complete
+                                                        and records the ones written now. Defaults to None.
 
     Returns:
         None
     """
-    with MoshZip(source) as zip_ref:
-        non_videos = (
-            video
-            for video in natsorted(zip_ref.namelist())
-            if video in zip_ref.namelist_from_ext(".zip", ".pdf")
-        )
+    with _borrow(source) as zip_ref:
+        files = [
+            (entry, clean_path(target_dir / "Files" / entry.name))
+            for entry in zip_ref.manifest["attachment"]
+        ]
+        if manifest:
+            files = _pending(files, manifest)
         print("\nProcessing other files...")
-        for video in tqdm(list(non_videos)):
-            target = clean_path(target_dir / "Files" / video)
+        for entry, target in tqdm(files):
             target.parent.mkdir(parents=True, exist_ok=True)
-            target.write_bytes(zip_ref.read(video))
+            hasher = hashlib.sha256()
+            zip_ref.copy_member(entry.name, target, hasher=hasher)
+            if manifest:
+                manifest.record(target, entry, hasher.hexdigest())
 
 
+@profiled("merge_zips")
 def merge_zips(
-    *archives: Path, post_process: Optional[Callable[[Path], Path]] = None
-) -> Path:
+    *archives: Path,
+    post_process: Optional[Callable[[Path], Path]] = None,
+    jobs: int = MAX_WORKERS,
+) -> Path | MergedZip:
     """
     Merges multiple ZIP archives or directories into a single ZIP archive.
 
@@ -87,57 +176,241 @@ def merge_zips(
         *archives (Path): One or more paths to ZIP archives or directories to be merged.
         post_process (callable, optional): A function that takes a Path and returns a Path.
                                            This function is executed after extraction and before archiving. Defaults to None.
+        jobs (int, optional): Number of members to unpack in parallel. Defaults to MAX_WORKERS.
 
     Returns:
-        Path: The path to the resulting merged ZIP archive.
+        Path | MergedZip: The path to the resulting merged ZIP archive, or a merged view.
 
     Raises:
         BadZipFile: If any of the input ZIP files are corrupted.
 
     Notes:
         - If only one ZIP archive is provided, it will be returned as is.
-        - The function creates a temporary directory to unpack the contents of the provided archives or directories.
+        - Without post_process, a MergedZip view reading straight from the sources is returned,
+          so nothing is unpacked or copied.
+        - Otherwise the function creates a temporary directory to unpack the contents of the provided archives or directories.
+          The members of all the archives are unpacked concurrently.
         - The contents are then repacked into a new ZIP archive, which is saved in a temporary file.
+          Members left untouched by post_process are copied without being recompressed.
     """
     if len(archives) == 1 and archives[0].suffix == ".zip" and not post_process:
         return archives[0]
-    with TemporaryDirectory(dir=TEMP) as temp_dir:
+    if not post_process:
+        return MergedZip(*archives)
+    with TemporaryDirectory(dir=TEMP) as temp_dir, ExitStack() as stack:
         temp_dir = Path(temp_dir)
+        # (device, inode) of every extracted file -> where it was extracted from
+        origins: Dict[Tuple[int, int], Tuple[ZipFile, ZipInfo, int]] = {}
         print("Unpacking archives...")
-        for part_index, archive in enumerate(tqdm(archives)):
+        members: List[Tuple[ZipFile, ZipInfo, Path]] = []
+        for part_index, archive in enumerate(archives):
             if archive.is_dir():
                 shutil.move(str(archive), temp_dir / f"{part_index}")
                 continue
-            with ZipFile(archive, "r") as zip_ref:
-                for member in zip_ref.namelist():
-                    try:
-                        zip_ref.extract(member, temp_dir / f"{part_index}")
-                    except BadZipFile:
-                        print(f"Error: {member} skipped.")
+            zip_ref = stack.enter_context(ZipFile(archive, "r"))
+            for info in zip_ref.infolist():
+                members.append((zip_ref, info, temp_dir / f"{part_index}"))
 
-        if post_process:
-            temp_dir = post_process(temp_dir)
+        total = sum(info.file_size for _, info, _ in members)
+        results = imap_ordered(_unpack_member, members, jobs)
+        with tqdm(total=total, unit="B", unit_scale=True) as pbar:
+            for (zip_ref, info, _), extracted in zip(members, results):
+                pbar.update(info.file_size)
+                if extracted is None:
+                    print(f"Error: {info.filename} skipped.")
+                    continue
+                stat = extracted.stat()
+                origins[(stat.st_dev, stat.st_ino)] = (zip_ref, info, stat.st_mtime_ns)
+
+        temp_dir = post_process(temp_dir)
 
         with NamedTemporaryFile(dir=TEMP, delete=False, suffix=".zip") as output_zip:
             with ZipFile(output_zip, "w") as zipf:
                 for file in tqdm(list(temp_dir.rglob("*")), desc="Repacking archive"):
-                    zipf.write(file, file.relative_to(temp_dir))
+                    arcname = file.relative_to(temp_dir).as_posix()
+                    stat = file.stat()
+                    origin = origins.get((stat.st_dev, stat.st_ino))
+                    if origin and not file.is_dir():
+                        zip_ref, info, mtime = origin
+                        unchanged = stat.st_mtime_ns == mtime
+                        if unchanged and stat.st_size == info.file_size:
+                            copy_raw(zip_ref, info, zipf, arcname)
+                            continue
+                    zipf.write(file, arcname)
             return Path(output_zip.name)
 
 
-def add_file_to_zip(zip_path: Path, file_to_add: Path, after: str) -> None:
+def _unpack_member(member: Tuple[ZipFile, ZipInfo, Path]) -> Path | None:
+    """
+    Extracts a single member below the given directory, like ZipFile.extract but
+    safe to run from several threads at once. Returns None if the member is corrupted.
+    """
+    zip_ref, info, directory = member
+    parts = PurePosixPath(info.filename.replace("\\", "/")).parts
+    target = directory.joinpath(*(part for part in parts if part not in ("/", "..")))
+    if info.is_dir():
+        target.mkdir(parents=True, exist_ok=True)
+        return target
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with zip_ref.open(info) as source, target.open("wb") as output:
+            copy_stream(source, output)
+    except BadZipFile:
+        target.unlink(missing_ok=True)
+        return None
+    return target
+
+
+def repack(archive: MergedZip, output: Path) -> Path:
+    """
+    Writes a merged view into a real ZIP archive.
+
+    Members that come from zip archives are copied as they are, without being
+    decompressed and compressed again; only files added from disk are compressed.
+
+    Args:
+        archive (MergedZip): The merged view to write.
+        output (Path): The path of the ZIP archive to create.
+
+    Returns:
+        Path: The path to the created ZIP archive.
+    """
+    with ZipFile(output, "w") as zipf:
+        for entry in tqdm(archive.entries, desc="Repacking archive"):
+            source, member = archive.locate(entry.name)
+            if isinstance(source, Path):
+                zipf.write(source, entry.name)
+            else:
+                copy_raw(source, source.getinfo(member), zipf, entry.name)
+    return output
+
+
+def copy_raw(
+    source: ZipFile,
+    info: ZipInfo,
+    target: ZipFile,
+    arcname: str,
+    buffer_size: int = BUFFER_SIZE,
+) -> None:
+    """
+    Copies the compressed bytes of a member from one ZIP archive into another.
+
+    The member keeps its compression method, CRC and sizes, so nothing is
+    decompressed or compressed again and the copy runs at disk speed.
+
+    Args:
+        source (ZipFile): The archive to copy the member from.
+        info (ZipInfo): The member to copy.
+        target (ZipFile): The archive, opened for writing, to copy the member into.
+        arcname (str): The name of the member in the target archive.
+        buffer_size (int, optional): The size of each chunk in bytes. Defaults to BUFFER_SIZE.
+
+    Raises:
+        BadZipFile: If the local header of the member is corrupted.
+    """
+    zinfo = ZipInfo(arcname, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.CRC = info.CRC
+    zinfo.file_size = info.file_size
+    zinfo.compress_size = info.compress_size
+    zinfo.external_attr = info.external_attr
+    # Sizes are written into the local header, so no data descriptor follows.
+    zinfo.flag_bits = info.flag_bits & ~0x08
+    zip64 = zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT
+
+    with open(str(source.filename), "rb") as fp:
+        fp.seek(info.header_offset)
+        header = struct.unpack(structFileHeader, fp.read(sizeFileHeader))
+        if header[0] != stringFileHeader:
+            raise BadZipFile(f"Bad local header for {info.filename}")
+        # skip the file name and extra field that follow the fixed-size header
+        fp.seek(header[10] + header[11], os.SEEK_CUR)
+
+        # There is no public API for writing pre-compressed data, so do what
+        # ZipFile.write does by hand.
+        with target._lock:  # type: ignore
+            zinfo.header_offset = target.fp.tell()  # type: ignore
+            target.fp.write(zinfo.FileHeader(zip64))  # type: ignore
+            remaining = info.compress_size
+            while remaining:
+                chunk = fp.read(min(buffer_size, remaining))
+                if not chunk:
+                    raise BadZipFile(f"Truncated data for {info.filename}")
+                target.fp.write(chunk)  # type: ignore
+                remaining -= len(chunk)
+            target.filelist.append(zinfo)
+            target.NameToInfo[arcname] = zinfo
+            target.start_dir = target.fp.tell()  # type: ignore
+            target._didModify = True  # type: ignore
+
+
+def add_file_to_zip(zip_path: Path | MergedZip, file_to_add: Path, after: str) -> None:
     """
     Adds a file to an existing ZIP archive, renaming it based on an existing file in the archive.
 
     Args:
-        zip_path (Path): The path to the ZIP archive.
+        zip_path (Path | MergedZip): The path to the ZIP archive, or a merged view.
         file_to_add (Path): The path to the file to be added to the ZIP archive.
         after (str): A string to match against existing file names in the ZIP archive. The new file will be renamed based on the first match.
 
     Returns:
         None
     """
-    with zipfile.ZipFile(zip_path, "a") as zipf:
-        target_file = Path(next(filter(lambda x: after in x, zipf.namelist())))
-        arcname = target_file.with_stem(target_file.stem + "0")
+    if isinstance(zip_path, MergedZip):
+        arcname = _arcname_after(zip_path, after)
+        zip_path.add_file(file_to_add, arcname)
+        return
+    with MoshZip(zip_path, "a") as zipf:
+        arcname = _arcname_after(zipf, after)
         zipf.write(file_to_add, arcname=arcname)
+
+
+def add_blank_video(zip_path: Path | MergedZip, after: str, duration: int) -> None:
+    """
+    Adds a blank video right after a lesson, matching the resolution, frame rate
+    and audio of that lesson.
+
+    Args:
+        zip_path (Path | MergedZip): The path to the ZIP archive, or a merged view.
+        after (str): A string to match against the names of the lessons. The blank
+                     video is placed after the first match.
+        duration (int): The duration of the blank video in seconds.
+    """
+    with _borrow(zip_path) as archive:
+        name = _find_member(archive, after)
+        blank = get_blank_video(duration, like=probe_member(archive, name))
+    add_file_to_zip(zip_path, blank, after)
+
+
+def probe_member(archive: ArchiveView, name: str) -> MediaInfo:
+    """
+    Probes a member of an archive.
+
+    The result is cached by the content of the member, so the member is only
+    copied out of the archive the first time it is probed.
+
+    Args:
+        archive (ArchiveView): The archive containing the member.
+        name (str): The name of the member.
+
+    Returns:
+        MediaInfo: The streams and format information of the member.
+    """
+    entry = next(entry for entry in archive.entries if entry.name == name)
+    key = archive.content_key(entry)
+    data = _media_cache.get(key, float("inf"))
+    if data is None:
+        with NamedTemporaryFile(suffix=Path(name).suffix) as temp:
+            info = probe(archive.copy_member(name, Path(temp.name)))
+        data = {"streams": info.streams, "format": info.format}
+        _media_cache.set(key, data)
+    return MediaInfo(data)
+
+
+def _find_member(archive: ArchiveView, after: str) -> str:
+    return next(e.name for e in archive.entries if after in e.name)
+
+
+def _arcname_after(archive: ArchiveView, after: str) -> str:
+    target_file = Path(_find_member(archive, after))
+    return target_file.with_stem(target_file.stem + "0").as_posix()
@@ -0,0 +1,70 @@
+import json
+import os
+import time
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Any
+from urllib.parse import quote
+
+
+class DiskCache:
+    """
+    A small persistent key-value cache storing one JSON file per key.
+
+    Entries expire after a time-to-live given when reading them, and can be tied
+    to a tag (e.g. the build the data was fetched from) so that they are ignored
+    once the tag changes.
+
+    Args:
+        directory (Path): The directory to store the entries in.
+
+    Methods:
+        get(key: str, ttl: float, tag: str | None = None) -> Any:
+            Returns a fresh entry, or None.
+
+        set(key: str, value: Any, tag: str | None = None) -> None:
+            Stores an entry.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+
+    def get(self, key: str, ttl: float, tag: str | None = None) -> Any:
+        """
+        Returns the value stored under a key if it is fresh enough.
+
+        Args:
+            key (str): The key of the entry.
+            ttl (float): The maximum age of the entry in seconds.
+            tag (str | None, optional): The tag the entry must have been stored with. Defaults to None.
+
+        Returns:
+            Any: The stored value, or None if it is missing, expired or has another tag.
+        """
+        try:
+            entry = json.loads(self.__path(key).read_text())
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry["time"] > ttl or entry["tag"] != tag:
+            return None
+        return entry["value"]
+
+    def set(self, key: str, value: Any, tag: str | None = None) -> None:
+        """
+        Stores a JSON serializable value under a key.
+
+        Args:
+            key (str): The key of the entry.
+            value (Any): The value to store.
+            tag (str | None, optional): A tag to store along with the value. Defaults to None.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        entry = {"time": time.time(), "tag": tag, "value": value}
+        with NamedTemporaryFile(
+            "w", dir=self.directory, suffix=".tmp", delete=False
+        ) as temp:
+            json.dump(entry, temp)
+        os.replace(temp.name, self.__path(key))
+
+    def __path(self, key: str) -> Path:
+        return self.directory / f"{quote(key, safe='')}.json"
@@ -1,8 +1,34 @@
 import os
 from pathlib import Path
+from typing import Any
 
 ON_ANDROID = "ANDROID_STORAGE" in os.environ
 HOME = Path("/sdcard") if ON_ANDROID else Path.home()
-TEMP = HOME / "tmp"
-TEMP.mkdir(parents=True, exist_ok=True)
-DOWNLOADS = next(HOME.glob("Download*"))
+CACHE = Path.home() / ".cache" / "codewithmosh"
+# Default size of the worker pools used for disk bound work.
+MAX_WORKERS = min(8, os.cpu_count() or 1)
+# Maximum number of concurrent requests to a single service.
+MAX_CONNECTIONS = 8
+# Chunk size used when streaming archive members; kept small on Android hosts.
+BUFFER_SIZE = int(
+    os.environ.get("CWM_BUFFER_SIZE", (256 if ON_ANDROID else 1024) * 1024)
+)
+
+
+def __getattr__(name: str) -> Any:
+    """
+    Resolves the settings that touch the filesystem on first use, so that
+    importing this module stays cheap:
+
+    - TEMP: the directory for temporary files, created if it doesn't exist.
+    - DOWNLOADS: the downloads directory of the user.
+    """
+    if name == "TEMP":
+        value = HOME / "tmp"
+        value.mkdir(parents=True, exist_ok=True)
+    elif name == "DOWNLOADS":
+        value = next(HOME.glob("Download*"))
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
@@ -1,5 +1,12 @@
+import hashlib
+import json
+import os
+from concurrent.futures import Future
 from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory
+from threading import Lock
+from typing import Callable, Dict, List
+from zipfile import BadZipFile, ZipFile
 
 import requests
 import yt_dlp  # type: ignore
@@ -7,8 +14,16 @@ from bs4 import BeautifulSoup
 from tqdm import tqdm
 
 from seedr.account import SeedrAccount
-from seedr.path import SeedrFolder
-from utils.configs import DOWNLOADS, TEMP
+from seedr.path import SeedrFile, SeedrFolder
+from utils.configs import BUFFER_SIZE, DOWNLOADS, MAX_CONNECTIONS, TEMP
+from utils.network import get_session
+from utils.pool import imap_ordered
+from utils.profile import count, profiled
+
+# Files smaller than two segments are downloaded over a single connection.
+MIN_SEGMENT_SIZE = 16 * 1024 * 1024
+# How much data is written between two saves of the progress of a download.
+CHECKPOINT_SIZE = 64 * 1024 * 1024
 
 
 def download_video(url: str, path: Path = DOWNLOADS):
@@ -32,77 +47,409 @@ def download_video(url: str, path: Path = DOWNLOADS):
         ydl.download([url])  # type: ignore
 
 
-def download_magnet(magnet: str) -> Path:
+def add_magnets(magnets: List[str], quiet: bool = False) -> Callable[[str], int]:
+    """
+    Prepares adding several magnet links to Seedr together, so that a single
+    tracker follows all of their torrents.
+
+    Args:
+        magnets (List[str]): The magnet links to add.
+        quiet (bool, optional): Don't show the progress of the torrents. Defaults to False.
+
+    Returns:
+        Callable[[str], int]: A function returning the folder created by one of the
+                              magnets. The first call adds every magnet and waits for
+                              all of them; the other calls, from any thread, reuse the
+                              result.
+    """
+    lock = Lock()
+    result: Future[Dict[str, int]] = Future()
+
+    def folder_of(magnet: str) -> int:
+        with lock:
+            if not result.done():
+                try:
+                    folder_ids = SeedrAccount.shared().add_torrents(magnets, quiet)
+                    result.set_result(dict(zip(magnets, folder_ids)))
+                except Exception as error:
+                    result.set_exception(error)
+        return result.result()[magnet]
+
+    return folder_of
+
+
+@profiled("download_magnet")
+def download_magnet(
+    magnet: str,
+    connections: int = MAX_CONNECTIONS,
+    desc: str = "Downloading files",
+    quiet: bool = False,
+    folder_id: int | None = None,
+) -> Path:
     """
     Downloads files from a magnet link using the Seedr service.
 
+    The files are fetched over plain HTTP streams, several at a time, into a
+    directory that mirrors the folder layout on Seedr. A file whose direct
+    download fails is retried through yt_dlp.
+
     Args:
         magnet (str): The magnet link to download.
+        connections (int, optional): The maximum number of files downloaded at once. Defaults to MAX_CONNECTIONS.
+        desc (str, optional): The label of the progress bar. Defaults to "Downloading files".
+        quiet (bool, optional): Don't show the progress of the torrent on Seedr. Defaults to False.
+        folder_id (int | None, optional): The folder the magnet already created on Seedr,
+                                          if it was added beforehand. Defaults to None.
 
     Returns:
         Path: The path to the directory where the files are downloaded.
     """
     target = Path(TemporaryDirectory(dir=TEMP, delete=False).name)
-    account = SeedrAccount()
-    folder_id = account.add_torrent(magnet)
-    folder = SeedrFolder(folder_id)
-    for file in folder.traverse():
-        url = file.url
-        path = target / file.path
-        download_video(url, path)
+    account = SeedrAccount.shared()
+    if folder_id is None:
+        folder_id = account.add_torrent(magnet, quiet)
+    folder = SeedrFolder(folder_id, account)
+    files = list(folder.traverse())
+    total_size = sum(file.size or 0 for file in files)
+    with tqdm(total=total_size, unit="B", unit_scale=True, desc=desc) as pbar:
+        lock = Lock()
+
+        def download(file: SeedrFile) -> None:
+            path = target / file.path
+            try:
+                _download_file(file.url, path, pbar, lock)
+            except requests.RequestException:
+                download_video(file.url, path)
+                with lock:
+                    pbar.update(file.size or 0)
+
+        for _ in imap_ordered(download, files, connections):
+            pass
     return target
 
 
-def gdrive_direct_download_url(file_id: str) -> str:
+def _download_file(url: str, path: Path, pbar: tqdm, lock: Lock) -> None:  # type: ignore
+    """
+    Streams a URL into a file, reporting progress to a shared progress bar.
     """
-    Given a Google Drive file ID, return a direct download URL that works
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f"{path.name}.part")
+    written = 0
+    try:
+        with get_session().get(url, stream=True) as r:
+            r.raise_for_status()
+            with partial.open("wb") as f:
+                for chunk in r.iter_content(chunk_size=BUFFER_SIZE):
+                    f.write(chunk)
+                    written += len(chunk)
+                    with lock:
+                        pbar.update(len(chunk))
+    except requests.RequestException:
+        partial.unlink(missing_ok=True)
+        with lock:
+            pbar.update(-written)
+        raise
+    partial.replace(path)
+
+
+@profiled("open_gdrive_download")
+def open_gdrive_download(file_id: str) -> requests.Response:
+    """
+    Given a Google Drive file ID, open a streaming download of the file that works
     for both small and large files (handles confirm + uuid params).
 
+    Small files are served by the first request, whose response is returned as is
+    instead of being dropped and fetched again.
+
     Args:
         file_id (str): The Google Drive file ID.
 
     Returns:
-        str: A direct download URL suitable for requests/wget/etc.
+        requests.Response: An open, streaming response with the file content.
+
+    Raises:
+        HTTPError: If the HTTP request returned an unsuccessful status code.
+        RuntimeError: If the confirmation page cannot be parsed.
     """
+    session = get_session()
     base_url = f"https://drive.google.com/uc?export=download&id={file_id}"
-    session = requests.Session()
     response = session.get(base_url, stream=True)
     response.raise_for_status()
 
-    if "text/html" in response.headers.get("Content-Type", ""):
+    if "text/html" not in response.headers.get("Content-Type", ""):
+        return response
+
+    with response:
         soup = BeautifulSoup(response.content, "html.parser")
-        tag = soup.select_one("input[type=hidden][name=uuid]")
-        if tag:
-            uuid = tag["value"]
-            return f"https://drive.usercontent.google.com/download?id={file_id}&export=download&authuser=0&confirm=t&uuid={uuid}"
+    tag = soup.select_one("input[type=hidden][name=uuid]")
+    if not tag:
         raise RuntimeError("Could not extract Google Drive uuid token.")
-
-    return base_url
+    uuid = tag["value"]
+    url = f"https://drive.usercontent.google.com/download?id={file_id}&export=download&authuser=0&confirm=t&uuid={uuid}"
+    response = session.get(url, stream=True)
+    response.raise_for_status()
+    return response
 
 
-def download_archive(url: str, suffix: str = ".zip") -> Path:
+@profiled("download_archive")
+def download_archive(
+    url: str | requests.Response,
+    suffix: str = ".zip",
+    connections: int = MAX_CONNECTIONS,
+    key: str | None = None,
+    desc: str = "Downloading archive",
+) -> Path:
     """
     Downloads a file from the given URL and saves it as a temporary file with the specified suffix.
 
+    If the server supports range requests, the file is split into segments that
+    are downloaded over several connections at once and written in place into a
+    preallocated file. Otherwise it is downloaded over a single stream.
+
+    Ranged downloads are resumable: the partial file and the progress of each
+    segment are kept under TEMP, keyed by the given key (or the URL), and a later
+    call with the same key continues where the previous one stopped, as long as
+    the server still reports the same ETag / Last-Modified for the file.
+
     Args:
-        url (str): The URL of the file to download.
+        url (str | requests.Response): The URL of the file to download, or an already
+                                       opened streaming response to read it from.
         suffix (str, optional): The suffix for the temporary file. Defaults to ".zip".
+        connections (int, optional): The maximum number of concurrent connections. Defaults to MAX_CONNECTIONS.
+        key (str | None, optional): A stable identifier of the file, such as a Google Drive
+                                    file ID, used to find a partial download. Defaults to the URL.
+        desc (str, optional): The label of the progress bar. Defaults to "Downloading archive".
 
     Returns:
         Path: The path to the downloaded temporary file.
 
     Raises:
         HTTPError: If the HTTP request returned an unsuccessful status code.
+        BadZipFile: If a ".zip" download does not have a valid zip structure.
     """
-    file = Path(NamedTemporaryFile(dir=TEMP, suffix=suffix).name)
-    with requests.get(url, stream=True) as r:
+    response = url if isinstance(url, requests.Response) else None
+    with response or get_session().get(str(url), stream=True) as r:
         r.raise_for_status()
-        with file.open("wb") as f:
-            total_size = int(r.headers.get("content-length", 0))
-            with tqdm(
-                total=total_size, unit="B", unit_scale=True, desc="Downloading archive"
-            ) as pbar:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    pbar.update(len(chunk))
-    return file
+        total_size = int(r.headers.get("content-length", 0))
+        partial = PartialDownload(key or str(url if response is None else r.url))
+        with tqdm(total=total_size, unit="B", unit_scale=True, desc=desc) as pbar:
+            if not _supports_segments(r, total_size):
+                _download_stream(r, partial, pbar)
+            else:
+                try:
+                    _download_segments(r, partial, total_size, connections, pbar)
+                except RangeIgnoredError:
+                    # start over on a single stream, which needs no range support
+                    pbar.reset()
+                    with get_session().get(r.url, stream=True) as retry:
+                        retry.raise_for_status()
+                        _download_stream(retry, partial, pbar)
+    if suffix == ".zip":
+        try:
+            _verify_zip(partial.file)
+        except BadZipFile:
+            partial.discard()
+            raise
+    count("bytes downloaded", partial.file.stat().st_size)
+    return partial.finish(suffix)
+
+
+class PartialDownload:
+    """
+    A download in progress, persisted under TEMP so that it survives restarts.
+
+    The data is written to a ".part" file and the progress of every segment is
+    stored next to it in a JSON file, along with the size and the validator
+    (ETag or Last-Modified) of the remote file.
+
+    Args:
+        key (str): A stable identifier of the file being downloaded.
+    """
+
+    directory = TEMP / "downloads"
+
+    def __init__(self, key: str) -> None:
+        name = hashlib.sha256(key.encode()).hexdigest()[:32]
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.file = self.directory / f"{name}.part"
+        self.state = self.directory / f"{name}.json"
+
+    def load(self, size: int, validator: str) -> List[List[int]] | None:
+        """
+        Returns the [start, offset, end] of every segment of a matching partial
+        download, or None if there is nothing to resume.
+        """
+        try:
+            state = json.loads(self.state.read_text())
+        except (OSError, ValueError):
+            return None
+        if not self.file.exists() or state["size"] != size:
+            return None
+        if state["validator"] != validator:
+            return None
+        return state["segments"]
+
+    def save(self, size: int, validator: str, segments: List[List[int]]) -> None:
+        state = {"size": size, "validator": validator, "segments": segments}
+        temp = self.state.with_suffix(".tmp")
+        temp.write_text(json.dumps(state))
+        os.replace(temp, self.state)
+
+    def discard(self) -> None:
+        self.file.unlink(missing_ok=True)
+        self.state.unlink(missing_ok=True)
+
+    def finish(self, suffix: str) -> Path:
+        """
+        Moves the completed download out of the way of future downloads and returns its new path.
+        """
+        with NamedTemporaryFile(dir=TEMP, suffix=suffix, delete=False) as temp:
+            target = Path(temp.name)
+        os.replace(self.file, target)
+        self.state.unlink(missing_ok=True)
+        return target
+
+
+class RangeIgnoredError(RuntimeError):
+    """Raised when a server answers a range request with something else than that range."""
+
+
+def _download_stream(
+    response: requests.Response,
+    partial: PartialDownload,
+    pbar: tqdm,  # type: ignore
+) -> None:
+    """
+    Downloads a file over a single stream, replacing any partial download.
+    """
+    partial.discard()
+    with partial.file.open("wb") as f:
+        for chunk in response.iter_content(chunk_size=BUFFER_SIZE):
+            f.write(chunk)
+            pbar.update(len(chunk))
+
+
+def _supports_segments(response: requests.Response, size: int) -> bool:
+    headers = response.headers
+    return (
+        hasattr(os, "pwrite")
+        and size > 0
+        and headers.get("Accept-Ranges", "").lower() == "bytes"
+        and headers.get("Content-Encoding", "identity") == "identity"
+    )
+
+
+def _download_segments(
+    response: requests.Response,
+    partial: PartialDownload,
+    size: int,
+    connections: int,
+    pbar: tqdm,  # type: ignore
+) -> None:
+    """
+    Downloads a file over one or more HTTP range requests at once, resuming a
+    matching partial download if there is one.
+
+    A fresh first segment is read from the response that is already open; every
+    other request goes to the final URL of that response with an If-Range header,
+    so a file that changed on the server is never stitched together. Weak ETags
+    can't be used in If-Range, so the Last-Modified date is used instead and files
+    with neither are never resumed.
+
+    Raises:
+        RangeIgnoredError: If the server doesn't answer a range request with that range.
+                           The partial download is discarded, so it isn't retried as is.
+    """
+    etag = response.headers.get("ETag", "")
+    # weak ETags can't be used in If-Range, but a Last-Modified date can
+    validator = "" if etag.startswith("W/") else etag
+    validator = validator or response.headers.get("Last-Modified", "")
+    segments = partial.load(size, validator) if validator else None
+    resuming = segments is not None
+    if segments is None:
+        segment_count = max(1, min(connections, size // MIN_SEGMENT_SIZE))
+        segment_size = -(-size // segment_count)
+        segments = [
+            [start, start, min(start + segment_size, size) - 1]
+            for start in range(0, size, segment_size)
+        ]
+    pbar.update(sum(offset - start for start, offset, _ in segments))
+    lock = Lock()
+    saved = [0]
+
+    def checkpoint(written: int) -> None:
+        with lock:
+            pbar.update(written)
+            saved[0] += written
+            if validator and saved[0] >= CHECKPOINT_SIZE:
+                saved[0] = 0
+                os.fsync(fd)
+                partial.save(size, validator, segments)
+
+    def fetch(segment: List[int]) -> None:
+        start, offset, end = segment
+        if offset > end:
+            return
+        source = response
+        if offset:
+            headers = {"Range": f"bytes={offset}-{end}"}
+            if validator:
+                headers["If-Range"] = validator
+            source = get_session().get(response.url, headers=headers, stream=True)
+            source.raise_for_status()
+            if source.status_code != 206:
+                source.close()
+                raise RangeIgnoredError(f"{response.url} changed or ignored the range")
+        with source:
+            for chunk in source.iter_content(chunk_size=BUFFER_SIZE):
+                chunk = chunk[: end + 1 - offset]
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+                segment[1] = offset
+                checkpoint(len(chunk))
+                if offset > end:
+                    break
+        if offset <= end:
+            raise ConnectionError(f"Segment {start}-{end} ended at byte {offset}")
+
+    if segments[0][1]:
+        # the open response starts at byte 0, which is already on disk
+        response.close()
+    # a fresh download must not keep the stale bytes of an older, larger file
+    flags = os.O_WRONLY | os.O_CREAT | (0 if resuming else os.O_TRUNC)
+    fd = os.open(partial.file, flags, 0o644)
+    ignored = False
+    try:
+        if os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)
+            try:
+                os.posix_fallocate(fd, 0, size)
+            except (AttributeError, OSError):
+                pass
+        for _ in imap_ordered(fetch, segments, connections):
+            pass
+    except RangeIgnoredError:
+        ignored = True
+        raise
+    finally:
+        os.fsync(fd)
+        os.close(fd)
+        if ignored:
+            partial.discard()
+        elif validator:
+            partial.save(size, validator, segments)
+
+
+def _verify_zip(file: Path) -> None:
+    """
+    Checks that a downloaded file is a zip archive whose central directory and
+    local headers are intact, without decompressing anything.
+
+    Raises:
+        BadZipFile: If the structure of the archive is broken.
+    """
+    with ZipFile(file) as zip_ref, file.open("rb") as fp:
+        for info in zip_ref.infolist():
+            fp.seek(info.header_offset)
+            if fp.read(4) != b"PK\x03\x04":
+                raise BadZipFile(f"Bad local header for {info.filename} in {file}")
@@ -1,10 +1,9 @@
 import re
 import subprocess
 from pathlib import Path
+from typing import Any, BinaryIO
 
-from pyperclip import copy  # type: ignore
-
-from utils.configs import ON_ANDROID
+from utils.configs import BUFFER_SIZE, ON_ANDROID
 
 
 def copy_to_clipboard(text: str, label: str = "Text", quiet: bool = False) -> None:
@@ -22,6 +21,8 @@ def copy_to_clipboard(text: str, label: str = "Text", quiet: bool = False) -> No
     if ON_ANDROID:
         __termux_copy(text, label)
     else:
+        from pyperclip import copy  # type: ignore
+
         copy(text)
     if not quiet:
         print(f"{label}: {text} copied...✔")
@@ -66,3 +67,33 @@ def clean_path(path: Path) -> Path:
         path_str = path_str.replace(bad, replacement)
 
     return Path(re.sub(r"\s+", " ", path_str))
+
+
+def copy_stream(
+    source: BinaryIO,
+    target: BinaryIO,
+    buffer_size: int = BUFFER_SIZE,
+    hasher: Any = None,
+) -> int:
+    """
+    Copies a binary stream into another one chunk by chunk.
+
+    Only one chunk is held in memory at a time, so the memory usage does not
+    depend on the size of the stream.
+
+    Args:
+        source (BinaryIO): The stream to read from.
+        target (BinaryIO): The stream to write to.
+        buffer_size (int, optional): The size of each chunk in bytes. Defaults to BUFFER_SIZE.
+        hasher (hashlib hash object, optional): Updated with every chunk that is copied. Defaults to None.
+
+    Returns:
+        int: The number of bytes copied.
+    """
+    copied = 0
+    while chunk := source.read(buffer_size):
+        target.write(chunk)
+        if hasher is not None:
+            hasher.update(chunk)
+        copied += len(chunk)
+    return copied
@@ -0,0 +1,102 @@
+import json
+from pathlib import Path
+from typing import Any, Dict
+
+from archive import ArchiveEntry
+
+
+class CompletionManifest:
+    """
+    Keeps track of the outputs of a course that were written completely.
+
+    Records are appended to a JSON-lines file in the course directory as soon as
+    a target is finished, so a crashed run loses at most the targets that were
+    being written. A target counts as complete on the next run if it was recorded
+    from the same source member and still has the recorded size.
+
+    Args:
+        directory (Path): The output directory of the course.
+
+    Methods:
+        is_complete(target: Path, entry: ArchiveEntry) -> bool:
+            Checks whether a target was already written from the given member.
+
+        record(target: Path, entry: ArchiveEntry, digest: str) -> None:
+            Records a target as complete.
+    """
+
+    filename = ".codewithmosh.jsonl"
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.path = directory / self.filename
+        self.__records: Dict[str, Dict[str, Any]] = self.__load()
+
+    @staticmethod
+    def fingerprint(entry: ArchiveEntry) -> str:
+        """
+        Identifies the content of a source member independently of its name.
+        """
+        crc = "--------" if entry.crc is None else f"{entry.crc:08x}"
+        return f"{crc}:{entry.size}"
+
+    def is_complete(self, target: Path, entry: ArchiveEntry) -> bool:
+        """
+        Checks whether a target was already written completely from the given member.
+
+        Args:
+            target (Path): The output file.
+            entry (ArchiveEntry): The member the output is made from.
+
+        Returns:
+            bool: True if the target can be skipped, False if it has to be (re)written.
+        """
+        record = self.__records.get(self.__key(target))
+        if not record or record["source"] != self.fingerprint(entry):
+            return False
+        return target.is_file() and target.stat().st_size == record["size"]
+
+    def record(self, target: Path, entry: ArchiveEntry, digest: str) -> None:
+        """
+        Records a target as complete.
+
+        Args:
+            target (Path): The output file, which must already be fully written.
+            entry (ArchiveEntry): The member the output was made from.
+            digest (str): The SHA-256 of the output, computed while it was written.
+        """
+        key = self.__key(target)
+        record = {
+            "target": key,
+            "source": self.fingerprint(entry),
+            "size": target.stat().st_size,
+            "sha256": digest,
+        }
+        self.__records[key] = record
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a") as file:
+            file.write(json.dumps(record) + "\n")
+
+    @property
+    def count(self) -> int:
+        """The number of targets recorded as complete."""
+        return len(self.__records)
+
+    def __key(self, target: Path) -> str:
+        try:
+            return target.relative_to(self.directory).as_posix()
+        except ValueError:
+            return target.as_posix()
+
+    def __load(self) -> Dict[str, Dict[str, Any]]:
+        records: Dict[str, Dict[str, Any]] = {}
+        if not self.path.exists():
+            return records
+        for line in self.path.read_text().splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line of a crashed run may be cut short
+                continue
+            records[record["target"]] = record
+        return records
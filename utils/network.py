@@ -0,0 +1,49 @@
+from functools import cache
+from typing import Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from utils.configs import MAX_CONNECTIONS
+
+# (connect, read) timeouts in seconds applied to every request by default
+TIMEOUT = (10, 60)
+
+
+class Session(requests.Session):
+    """A requests session that applies a default timeout to every request."""
+
+    def request(self, method: str | bytes, url: str | bytes, *args: Any, **kwargs: Any) -> requests.Response:  # type: ignore
+        kwargs.setdefault("timeout", TIMEOUT)
+        return super().request(method, url, *args, **kwargs)
+
+
+@cache
+def get_session() -> requests.Session:
+    """
+    Returns the HTTP session shared by every network module.
+
+    Connections are kept alive and pooled per host, idempotent requests are
+    retried with exponential backoff on connection errors and transient server
+    errors, and every request gets a default timeout.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    session = Session()
+    retries = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=MAX_CONNECTIONS,
+        pool_maxsize=MAX_CONNECTIONS,
+        max_retries=retries,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
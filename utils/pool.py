@@ -0,0 +1,114 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Condition, Event
+from typing import Callable, Deque, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class Budget:
+    """
+    Limits how many tasks of one kind run at once across the whole process, e.g.
+    ffmpeg encodes started by several courses that are processed together.
+
+    Use it as a context manager around each task. Without a limit, entering it
+    never blocks.
+
+    Args:
+        limit (int | None, optional): The maximum number of tasks running at once. Defaults to None.
+
+    Methods:
+        set_limit(limit: int | None) -> None:
+            Changes the limit, waking up waiting tasks if it was raised.
+    """
+
+    def __init__(self, limit: int | None = None) -> None:
+        self.limit = limit
+        self.__running = 0
+        self.__condition = Condition()
+
+    def set_limit(self, limit: int | None) -> None:
+        with self.__condition:
+            self.limit = limit
+            self.__condition.notify_all()
+
+    def __enter__(self) -> None:
+        with self.__condition:
+            while self.limit is not None and self.__running >= self.limit:
+                self.__condition.wait()
+            self.__running += 1
+
+    def __exit__(self, *_) -> None:
+        with self.__condition:
+            self.__running -= 1
+            self.__condition.notify()
+
+
+# Shared by every course of a run; limited by main.py in batch mode.
+download_budget = Budget()
+ffmpeg_budget = Budget()
+
+
+def imap_ordered(
+    func: Callable[[T], R], items: Iterable[T], jobs: int = 1
+) -> Iterator[R]:
+    """
+    Lazily applies a function to every item using a bounded pool of worker threads.
+
+    At most ``2 * jobs`` items are queued at any time and the results are yielded in
+    the same order as the items. As soon as any call raises, the queued calls are
+    cancelled and the running ones are allowed to finish. The results of the calls
+    before the failed one are still yielded, then its exception is re-raised.
+
+    Args:
+        func (Callable[[T], R]): The function to apply to each item.
+        items (Iterable[T]): The items to process.
+        jobs (int, optional): The number of worker threads. Defaults to 1, which runs
+                              everything in the calling thread.
+
+    Yields:
+        R: The result of each call, in input order.
+    """
+    if jobs <= 1:
+        yield from map(func, items)
+        return
+
+    changed = Event()
+    pending: Deque[Future[R]] = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            iterator = iter(items)
+            for item in iterator:
+                if __failed(pending):
+                    break
+                future = executor.submit(func, item)
+                future.add_done_callback(lambda _: changed.set())
+                pending.append(future)
+                if len(pending) < 2 * jobs:
+                    continue
+                yield __next_result(pending, changed)
+            while pending:
+                yield __next_result(pending, changed)
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def __next_result(pending: Deque[Future[R]], changed: Event) -> R:
+    while True:
+        if __failed(pending):
+            # stop early, but only raise once the failed call is the next result
+            for future in pending:
+                future.cancel()
+        if pending[0].done():
+            return pending.popleft().result()
+        changed.wait()
+        changed.clear()
+
+
+def __failed(pending: Deque[Future[R]]) -> bool:
+    return any(
+        future.done() and not future.cancelled() and future.exception() is not None
+        for future in pending
+    )
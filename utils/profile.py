@@ -0,0 +1,167 @@
+import json
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+__enabled = False
+__origin = time.perf_counter_ns()
+__events: List[Dict[str, Any]] = []
+__counters: Dict[str, float] = {}
+__lock = threading.Lock()
+__disabled = nullcontext()
+
+
+def enable() -> None:
+    """
+    Starts recording spans and counters. Until this is called, every function of
+    this module returns immediately and records nothing.
+    """
+    global __enabled, __origin
+    __origin = time.perf_counter_ns()
+    __enabled = True
+
+
+def is_enabled() -> bool:
+    return __enabled
+
+
+def span(name: str, **args: Any) -> ContextManager[None]:
+    """
+    Times the enclosed block as one span of the trace.
+
+    Args:
+        name (str): The name of the span, under which it is summarized.
+        **args (Any): Details about this span to include in the trace.
+
+    Returns:
+        ContextManager[None]: A context manager timing the block, or a shared no-op one
+                              if profiling is disabled.
+    """
+    if not __enabled:
+        return __disabled
+    return __span(name, args)
+
+
+@contextmanager
+def __span(name: str, args: Dict[str, Any]) -> Iterator[None]:
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        end = time.perf_counter_ns()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": (start - __origin) / 1000,
+            "dur": (end - start) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args,
+        }
+        with __lock:
+            __events.append(event)
+
+
+def profiled(name: str) -> Callable[[F], F]:
+    """
+    Decorates a function so that every call to it is recorded as a span.
+
+    Args:
+        name (str): The name of the span.
+    """
+
+    def decorator(func: F) -> F:
+        @wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not __enabled:
+                return func(*args, **kwargs)
+            with __span(name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def count(name: str, value: float = 1) -> None:
+    """
+    Adds a value to a counter, e.g. the number of bytes downloaded.
+    """
+    if not __enabled:
+        return
+    with __lock:
+        total = __counters[name] = __counters.get(name, 0) + value
+        __events.append(
+            {
+                "name": name,
+                "ph": "C",
+                "ts": (time.perf_counter_ns() - __origin) / 1000,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": {name: total},
+            }
+        )
+
+
+def run(command: List[str], **kwargs: Any) -> subprocess.CompletedProcess:
+    """
+    Runs a command like subprocess.run, recording it as a span named after the program.
+    """
+    if not __enabled:
+        return subprocess.run(command, **kwargs)
+    program = Path(command[0]).name
+    with __span(f"subprocess:{program}", {"command": command}):
+        return subprocess.run(command, **kwargs)
+
+
+def write_trace(path: Path) -> None:
+    """
+    Writes the recorded spans and counters to a file.
+
+    Files ending in ".jsonl" get one JSON event per line; anything else gets a
+    Chrome trace that can be opened in chrome://tracing or https://ui.perfetto.dev.
+
+    Args:
+        path (Path): The file to write.
+    """
+    with __lock:
+        events = list(__events)
+    if path.suffix == ".jsonl":
+        path.write_text("".join(json.dumps(event) + "\n" for event in events))
+    else:
+        path.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+
+
+def summary() -> str:
+    """
+    Summarizes the recorded spans by name, slowest first, followed by the counters.
+
+    Returns:
+        str: The summary as a table.
+    """
+    with __lock:
+        spans = [event for event in __events if event["ph"] == "X"]
+        counters = dict(__counters)
+    stats: Dict[str, List[float]] = {}
+    for event in spans:
+        stats.setdefault(event["name"], []).append(event["dur"] / 1000)
+    lines = [f"{'span':<32}{'calls':>7}{'total s':>10}{'mean ms':>10}{'max ms':>10}"]
+    for name, durations in sorted(stats.items(), key=lambda item: -sum(item[1])):
+        total = sum(durations)
+        lines.append(
+            f"{name:<32}{len(durations):>7}{total / 1000:>10.2f}"
+            f"{total / len(durations):>10.1f}{max(durations):>10.1f}"
+        )
+    if counters:
+        lines.append("")
+        lines.append(f"{'counter':<32}{'total':>17}")
+        for name, total in sorted(counters.items()):
+            lines.append(f"{name:<32}{total:>17,.0f}")
+    return "\n".join(lines)